@@ -4,6 +4,7 @@ import os
 from tempfile import NamedTemporaryFile
 from gigaam.onnx_utils import load_onnx_sessions, transcribe_sample
 import logging
+from artifacts import ArtifactStore
 
 
 EXCHANGE = 'text'
@@ -30,6 +31,9 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Распознанный текст - производный артефакт аудио: повторно не распознаём
+store = ArtifactStore(DATA_DIR)
+
 # Создаём функцию callback для обработки данных из очереди
 def callback(ch, method, properties, body):
     logging.info(f'Получено сообщение - {body}')
@@ -38,8 +42,15 @@ def callback(ch, method, properties, body):
     audio_file_name = message['audio_file']
     audio_file_path = os.path.join(DATA_DIR, audio_file_name)
     tstamp = message['timestamp']
-    logging.info(f'start transcribe: {audio_file_path}')
-    recognized_text = transcribe_sample(audio_file_path, model_type, sessions)
+    text_key = message.get('audio_key') and store.derive(message['audio_key'], 'asr', {'model': model_type})
+    cached = text_key and store.load_json(text_key)
+    if cached:
+        recognized_text = cached['text']
+    else:
+        logging.info(f'start transcribe: {audio_file_path}')
+        recognized_text = transcribe_sample(audio_file_path, model_type, sessions)
+        if text_key:
+            store.save_json(text_key, {'text': recognized_text})
 
     logging.info(f'recognized_text: {recognized_text}')
 
@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+
+from prometheus_client import Counter, Gauge
+
+
+# Поиск производных артефактов: hit - работа уже сделана и пропускается
+LOOKUPS = Counter('artifact_lookups_total', 'Поиск производных артефактов в хранилище', ['kind', 'result'])
+EVICTED = Counter('artifact_evicted_total', 'Удалено исходных артефактов вместе с производными', ['reason'])
+EVICTED_BYTES = Counter('artifact_evicted_bytes_total', 'Освобождено байт при вытеснении', ['reason'])
+STORE_BYTES = Gauge('artifact_store_bytes', 'Объём хранилища артефактов после вытеснения')
+STORE_SOURCES = Gauge('artifact_store_sources', 'Исходных артефактов в хранилище после вытеснения')
+
+# Ключ: sha256 исходного содержимого, далее через "/" - шаги получения производных
+KEY_RE = re.compile(r'^[0-9a-f]{64}(/[a-z_]+(-[0-9a-f]{12})?)*$')
+
+
+def digest(data):
+    """sha256 от байтов или от JSON-описания (ключи по порядку)"""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path, chunk=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Контентно-адресуемое хранилище файлов в общем томе data.
+
+    Исходные артефакты (загруженное видео) лежат в objects/<aa>/<ключ><расш>,
+    где ключ - sha256 содержимого, поэтому одинаковые файлы хранятся один раз.
+    Производные (видео -> аудио -> признаки) лежат в derived/<aa>/<ключ>/...:
+    ключ производного - ключ источника плюс шаг вида "audio-<хэш параметров>",
+    так что наличие файла означает, что эта работа с этими параметрами уже
+    выполнена. Файлы пишутся во временные и переименовываются. В сообщениях
+    передаются пути относительно корня хранилища (DATA_DIR).
+
+    Вытеснение удаляет источник вместе со всеми производными: сначала старше
+    max_age секунд, затем давно не использованные, пока объём больше
+    max_bytes. Использованным считается чтение через lookup/load_json; всё,
+    что трогали за последние keep_recent секунд, не удаляется.
+    """
+
+    def __init__(self, root, max_bytes=0, max_age=0, keep_recent=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep_recent = keep_recent
+
+    @staticmethod
+    def derive(key, kind, params=None):
+        """Ключ производного артефакта kind с параметрами params"""
+        step = f"{kind}-{digest(params)[:12]}" if params else kind
+        return f"{key}/{step}"
+
+    @staticmethod
+    def rel(key, ext=''):
+        """Путь артефакта относительно корня хранилища"""
+        if not KEY_RE.match(key):
+            raise ValueError(f"Некорректный ключ артефакта: {key}")
+        if '/' not in key:
+            return os.path.join('objects', key[:2], key + ext)
+        return os.path.join('derived', key[:2], key + ext)
+
+    @staticmethod
+    def key_of(rel):
+        """Ключ по относительному пути артефакта (без расширений) или None"""
+        parts = rel.replace(os.sep, '/').split('/')
+        if len(parts) < 3 or parts[0] not in ('objects', 'derived'):
+            return None
+        key = '/'.join(parts[2:]).split('.', 1)[0]
+        return key if KEY_RE.match(key) else None
+
+    def path(self, rel):
+        return os.path.join(self.root, rel)
+
+    def target(self, key, ext=''):
+        """Абсолютный путь для записи артефакта; каталог создаётся"""
+        path = self.path(self.rel(key, ext))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put(self, src_path, ext):
+        """
+        Переносит готовый файл в хранилище под ключом его содержимого.
+        Если такой файл уже есть, копия удаляется. Возвращает (ключ, путь).
+        """
+        key = file_digest(src_path)
+        rel = self.rel(key, ext)
+        path = self.target(key, ext)
+        if os.path.exists(path):
+            os.remove(src_path)
+            os.utime(path)
+        else:
+            os.replace(src_path, path)
+        return key, rel
+
+    @contextlib.contextmanager
+    def write(self, key, ext):
+        """Путь временного файла; после успешного блока он переименовывается в артефакт"""
+        path = self.target(key, ext)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            yield tmp
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def lookup(self, key, ext, kind=None):
+        """Относительный путь готового артефакта или None; попадание продлевает ему жизнь"""
+        rel = self.rel(key, ext)
+        path = self.path(rel)
+        found = os.path.exists(path)
+        LOOKUPS.labels(kind or key.rsplit('/', 1)[-1].split('-')[0], 'hit' if found else 'miss').inc()
+        if not found:
+            return None
+        os.utime(path)
+        return rel
+
+    def load_json(self, key, kind=None):
+        rel = self.lookup(key, '.json', kind)
+        if rel is None:
+            return None
+        with open(self.path(rel)) as f:
+            return json.load(f)
+
+    def save_json(self, key, data):
+        with self.write(key, '.json') as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+
+    def _sources(self):
+        """{ключ источника: [пути файлов и каталогов]} по objects и derived"""
+        sources = {}
+        for area in ('objects', 'derived'):
+            top = self.path(area)
+            if not os.path.isdir(top):
+                continue
+            for fan in os.scandir(top):
+                if not fan.is_dir():
+                    continue
+                for entry in os.scandir(fan.path):
+                    key = entry.name.split('.', 1)[0]
+                    if KEY_RE.match(key) and not entry.name.endswith('.tmp'):
+                        sources.setdefault(key, []).append(entry.path)
+        return sources
+
+    @staticmethod
+    def _usage(paths):
+        """Объём в байтах и время последнего использования (наибольший mtime)"""
+        size, used = 0, 0.0
+        for path in paths:
+            if os.path.isdir(path):
+                for dirpath, _, files in os.walk(path):
+                    for name in files:
+                        st = os.stat(os.path.join(dirpath, name))
+                        size += st.st_size
+                        used = max(used, st.st_mtime)
+            else:
+                st = os.stat(path)
+                size += st.st_size
+                used = max(used, st.st_mtime)
+        return size, used
+
+    def evict(self, now=None):
+        """Вытесняет источники по возрасту и объёму; возвращает число удалённых"""
+        now = time.time() if now is None else now
+        entries = []
+        for key, paths in self._sources().items():
+            try:
+                size, used = self._usage(paths)
+            except FileNotFoundError:
+                continue  # удаляется параллельно
+            entries.append((used, size, key, paths))
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        removed = 0
+        for used, size, key, paths in entries:
+            if now - used < self.keep_recent:
+                break
+            if self.max_age and now - used > self.max_age:
+                reason = 'age'
+            elif self.max_bytes and total > self.max_bytes:
+                reason = 'size'
+            else:
+                continue
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                # Опустевший каталог первого уровня (<aa>) тоже убираем
+                try:
+                    os.rmdir(os.path.dirname(path))
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+            EVICTED.labels(reason).inc()
+            EVICTED_BYTES.labels(reason).inc(size)
+        STORE_BYTES.set(total)
+        STORE_SOURCES.set(len(entries) - removed)
+        return removed
@@ -1,19 +1,53 @@
 import pika
 import json
 import os
+import time
+import functools
 import librosa
-import parselmouth
-from parselmouth.praat import call
 import logging
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from prometheus_client import Gauge, Histogram, start_http_server
+from artifacts import ArtifactStore
+from features import extract_audio_features, extract_stream_features
 
 EXCHANGE = 'feat'
 EXCHANGE_IN = 'audio'
+QUEUE = 'extract_aud_feat'
+# Прежняя очередь: её же объявляет audiofat для результатов из обменника feat
+LEGACY_QUEUE = 'extract_feat'
+REQUIRED_FIELDS = ('user_id', 'timestamp', 'audio_file')
+
+# Praat однопоточный: файлы обрабатываются в AUDFEAT_WORKERS процессах
+# (0 - в самом обработчике сообщения, как раньше)
+WORKERS = int(os.getenv("AUDFEAT_WORKERS", "0"))
+# Неподтверждённых сообщений у потребителя: ограничивает работу в процессах
+PREFETCH_COUNT = max(int(os.getenv("AUDFEAT_PREFETCH", str(max(WORKERS, 1) * 2))), 1)
+# Как часто опрашивать глубину очереди в RabbitMQ, секунды
+QUEUE_DEPTH_INTERVAL = float(os.getenv("AUDFEAT_QUEUE_DEPTH_INTERVAL", "15"))
+
+# Потоковый режим: запись читается окнами AUDFEAT_WINDOW_SEC со сдвигом
+# AUDFEAT_HOP_SEC, кроме сводных полей публикуются ряды по окнам (0 - весь файл)
+WINDOW_SECONDS = float(os.getenv("AUDFEAT_WINDOW_SEC", "0"))
+HOP_SECONDS = float(os.getenv("AUDFEAT_HOP_SEC", str(WINDOW_SECONDS)))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+QUEUE_DEPTH = Gauge('audfeat_queue_depth', f'Сообщений в очереди {QUEUE} в RabbitMQ')
+IN_FLIGHT = Gauge('audfeat_in_flight', 'Файлов принято и ещё не опубликовано')
+FILE_SECONDS = Histogram('audfeat_file_seconds', 'Время от получения сообщения до публикации признаков',
+                         buckets=(0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320))
 
 logging.basicConfig(level=logging.INFO,    
                     format='%(asctime)s - %(levelname)s - %(module)s - %(message)s'
                     )
 
+if WINDOW_SECONDS > 0 and not 0 < HOP_SECONDS <= WINDOW_SECONDS:
+    # Сдвиг больше окна пропускал бы звук между окнами
+    logging.warning(f"AUDFEAT_HOP_SEC={HOP_SECONDS} вне (0, {WINDOW_SECONDS}], используется сдвиг, равный окну")
+    HOP_SECONDS = WINDOW_SECONDS
+
 # Создаём подключение по адресу rabbitmq:
 connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
 channel = connection.channel()
@@ -26,103 +60,153 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Признаки - производный артефакт аудио; версия меняется вместе с набором признаков
+store = ArtifactStore(DATA_DIR)
+FEATURES_VERSION = 2
+FEATURES_PARAMS = {'version': FEATURES_VERSION, 'window': WINDOW_SECONDS, 'hop': HOP_SECONDS} \
+    if WINDOW_SECONDS > 0 else {'version': FEATURES_VERSION}
+
+# Функция извлечения для обработчика и для процессов пула
+extract = functools.partial(extract_stream_features, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS) \
+    if WINDOW_SECONDS > 0 else extract_audio_features
+
+
+
+def make_pool():
+    return ProcessPoolExecutor(max_workers=WORKERS) if WORKERS > 0 else None
+
+
+pool = make_pool()
+
+
+def publish_features(tag, message, features, started):
+    """Публикует признаки файла и подтверждает сообщение; без признаков - отклоняет"""
+    IN_FLIGHT.dec()
+    if not features:
+        logging.error(f"Признаки не получены: {message['audio_file']}")
+        channel.basic_nack(delivery_tag=tag, requeue=False)
+        return
+    logging.info(f'features: {features}')
+    result = dict(features, user_id=message['user_id'], timestamp=message['timestamp'])
+    channel.basic_publish(
+        exchange= EXCHANGE,
+        routing_key='',
+        body=json.dumps(result))
+    # Подтверждаем только после публикации результата
+    channel.basic_ack(delivery_tag=tag)
+    FILE_SECONDS.observe(time.monotonic() - started)
+    logging.info(f"Аудио успешно обработано")
+
+
+def replace_pool(used_pool):
+    """Пересоздаёт сломанный пул (если его ещё не заменили)"""
+    global pool
+    if pool is used_pool:
+        used_pool.shutdown(wait=False)
+        pool = make_pool()
 
 
-def extract_audio_features(audio_file_path):
+def on_extracted(tag, message, feat_key, started, used_pool, redelivered, future):
+    """Завершение файла в процессе пула; выполняется в потоке соединения"""
     try:
-        logging.info(f"Загрузка файла: {audio_file_path}")
-        snd = parselmouth.Sound(audio_file_path)
-        pitch = snd.to_pitch()
-        pitch_values = pitch.selected_array['frequency']
-        voiced = pitch_values[pitch_values > 0]
-        voiced = np.ravel(voiced)
-        pitch_mean = float(voiced.mean()) if voiced.size > 0 else np.nan
-        pitch_median = float(np.median(voiced)) if voiced.size > 0 else np.nan
-
-        intensity = snd.to_intensity()
-        loudness = np.nan
-        intensity_values = np.ravel(intensity.values) if hasattr(intensity, 'values') else np.array([])
-        if intensity_values.size > 0:
-            loudness = float(intensity_values.mean())
-
-        point_process = parselmouth.praat.call(snd, "To PointProcess (periodic, cc)", 75, 500)
-        voice_impulses = parselmouth.praat.call(point_process, "Get number of points")
-
-        total_duration = snd.get_total_duration()
-        speech_rate = voice_impulses / total_duration if total_duration > 0 else np.nan
-
-        pauses = 0.0
-        min_silence_length = 0.15
-        silence_thresh = loudness * 0.2 if not np.isnan(loudness) else 0
-        cur_pause = 0.0
-        timestep = 0.01
-        if intensity_values.size > 0:
-            for val in intensity_values:
-                if val < silence_thresh:
-                    cur_pause += timestep
-                else:
-                    if cur_pause > min_silence_length:
-                        pauses += cur_pause
-                    cur_pause = 0.0
-        pauses_scaled = pauses / total_duration if total_duration > 0 else np.nan
-
-        jitter = parselmouth.praat.call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
-        shimmer = parselmouth.praat.call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
-        jitter_perc = float(jitter) if jitter is not None else np.nan
-        shimmer_perc = float(shimmer) if shimmer is not None else np.nan
-        anxiety = np.nanmean([jitter_perc, shimmer_perc])
-
-        return {
-            'pitch_mean': round(pitch_mean, 2),
-            'pitch_median': round(pitch_median, 2),
-            'loudness': round(loudness, 2) if not np.isnan(loudness) else np.nan,
-            'voice_impulses': int(voice_impulses) if not np.isnan(voice_impulses) else np.nan,
-            'pauses_scaled': round(pauses_scaled, 5) if not np.isnan(pauses_scaled) else np.nan,
-            'jitter': round(jitter_perc, 5) if not np.isnan(jitter_perc) else np.nan,
-            'shimmer': round(shimmer_perc, 5) if not np.isnan(shimmer_perc) else np.nan,
-            'anxiety': round(anxiety, 3) if not np.isnan(anxiety) else np.nan,
-            'speech_rate': round(speech_rate, 3) if not np.isnan(speech_rate) else np.nan
-            }
+        features = future.result()
+    except BrokenProcessPool as e:
+        # Процесс пула упал (например, по памяти): файл один раз возвращается
+        # в очередь, при повторном падении отбрасывается, пул пересоздаётся
+        logging.error(f"Пул процессов сломан на {message['audio_file']} (повторная доставка: {redelivered}): {e}")
+        IN_FLIGHT.dec()
+        channel.basic_nack(delivery_tag=tag, requeue=not redelivered)
+        replace_pool(used_pool)
+        return
     except Exception as e:
         logging.error(f"Ошибка при извлечении характеристик: {e}")
-        return None
+        features = None
+    if feat_key and features:
+        store.save_json(feat_key, features)
+    publish_features(tag, message, features, started)
 
 
 # Создаём функцию callback для обработки данных из очереди
 def callback(ch, method, properties, body):
+    started = time.monotonic()
     logging.info(f'Получено сообщение - {body}')
-    message = json.loads(body)
-    user_id = message['user_id']
-    audio_file_name = message['audio_file']
-    audio_file_path = os.path.join(DATA_DIR, audio_file_name)
-    tstamp = message['timestamp']
-    logging.info(f'start extract: {audio_file_path}')
-    message = extract_audio_features(audio_file_path)
+    try:
+        message = json.loads(body)
+        missing = [field for field in REQUIRED_FIELDS if field not in message]
+    except (ValueError, TypeError) as e:
+        message, missing = None, [repr(e)]
+    if missing:
+        logging.error(f"Некорректное сообщение, нет полей {missing}: {body}")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    IN_FLIGHT.inc()
+    audio_file_path = os.path.join(DATA_DIR, message['audio_file'] or '')
+    feat_key = message.get('audio_key') and store.derive(message['audio_key'], 'feat', FEATURES_PARAMS)
+    features = feat_key and store.load_json(feat_key)
+    if features:
+        publish_features(method.delivery_tag, message, features, started)
+    elif pool is None:
+        logging.info(f'start extract: {audio_file_path}')
+        features = extract(audio_file_path)
+        if feat_key and features:
+            store.save_json(feat_key, features)
+        publish_features(method.delivery_tag, message, features, started)
+    else:
+        # Результаты публикуются в порядке готовности; done-callback приходит
+        # из служебного потока пула, поэтому публикация передаётся в поток соединения
+        logging.info(f'submit extract: {audio_file_path}')
+        used_pool = pool
+        try:
+            future = used_pool.submit(extract, audio_file_path)
+        except BrokenProcessPool as e:
+            # Пул сломался, а on_extracted упавшей задачи ещё не успел его заменить
+            logging.error(f"Пул процессов сломан, сообщение возвращено в очередь: {e}")
+            IN_FLIGHT.dec()
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            replace_pool(used_pool)
+            return
+        done = functools.partial(on_extracted, method.delivery_tag, message, feat_key, started,
+                                 used_pool, method.redelivered)
+        future.add_done_callback(
+            lambda f: connection.add_callback_threadsafe(functools.partial(done, f)))
+
+
+def queue_depth_timer():
+    """Глубина очереди по пассивному объявлению"""
+    try:
+        QUEUE_DEPTH.set(channel.queue_declare(queue=QUEUE, passive=True).method.message_count)
+    except Exception as e:
+        logging.error(f"Не удалось получить глубину очереди: {e}")
+    connection.call_later(QUEUE_DEPTH_INTERVAL, queue_depth_timer)
 
-    logging.info(f'features: {message}')
 
-    message['user_id'] = user_id
-    message['timestamp']  = tstamp
-
-    channel.basic_publish(
-        exchange= EXCHANGE,
-        routing_key='',
-        body=json.dumps(message))
-
-    logging.info(f"Аудио успешно обработано")
 
+def unbind_legacy_queue():
+    """
+    Снимает привязку прежней общей очереди к обменнику audio, чтобы audiofat
+    получал из неё только признаки. Отдельный канал: если очереди нет,
+    брокер закрывает его, а не основной.
+    """
+    legacy = connection.channel()
+    try:
+        legacy.queue_unbind(queue=LEGACY_QUEUE, exchange=EXCHANGE_IN, routing_key='')
+    except pika.exceptions.ChannelClosedByBroker as e:
+        logging.info(f"Очередь {LEGACY_QUEUE} не найдена: {e}")
+    finally:
+        if legacy.is_open:
+            legacy.close()
 
 
-channel.queue_declare(queue='extract_feat', durable=True)
-channel.queue_bind(exchange=EXCHANGE_IN, queue='extract_feat', routing_key='')
-channel.basic_consume(queue='extract_feat', on_message_callback=callback, auto_ack=True)
+unbind_legacy_queue()
+channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+channel.queue_declare(queue=QUEUE, durable=True)
+channel.queue_bind(exchange=EXCHANGE_IN, queue=QUEUE, routing_key='')
+channel.basic_consume(queue=QUEUE, on_message_callback=callback, auto_ack=False)
 
 
 if __name__ == "__main__":
     # Запускаем режим ожидания прихода сообщений
-    logging.info(f"Сервис извлечения характеристик стартует...")
+    logging.info(f"Сервис извлечения характеристик стартует (процессов: {WORKERS})...")
+    start_http_server(METRICS_PORT)
+    connection.call_later(QUEUE_DEPTH_INTERVAL, queue_depth_timer)
     channel.start_consuming()
-    
-    
-    
-
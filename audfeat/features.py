@@ -0,0 +1,302 @@
+import wave
+import logging
+
+import numpy as np
+import parselmouth
+from parselmouth.praat import call
+
+
+# Диапазон основного тона: общий для статистики высоты и PointProcess
+PITCH_FLOOR = 75
+PITCH_CEILING = 500
+# Паузы: кадры интенсивности тише 20% средней громкости, длиннее MIN_SILENCE секунд
+TIMESTEP = 0.01
+MIN_SILENCE = 0.15
+SILENCE_RATIO = 0.2
+
+
+def run_bounds(mask):
+    """Начала и концы (не включая) подряд идущих True в булевом массиве"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return edges[::2], edges[1::2]
+
+
+class PauseTracker:
+    """
+    Паузы по потоку кадров интенсивности, поданному частями: серии кадров
+    ниже порога, каждый кадр - timestep секунд. Считаются только серии
+    длиннее min_silence, завершённые громким кадром; незавершённая серия в
+    конце части переносится в следующую (пауза в конце записи не
+    учитывается). Длительности накапливаются в том же порядке, что и при
+    сложении по кадрам, поэтому для одной части результат совпадает с ним
+    до бита.
+    """
+
+    def __init__(self, timestep=TIMESTEP, min_silence=MIN_SILENCE):
+        self.timestep = timestep
+        self.min_silence = min_silence
+        self.run = 0  # длина незавершённой серии, кадров
+        self._table = np.empty(0)
+
+    def update(self, values, threshold):
+        """Секунды пауз, завершившихся в этой части"""
+        values = np.asarray(values)
+        if not values.size:
+            return 0.0
+        starts, ends = run_bounds(values < threshold)
+        lengths = ends - starts
+        if self.run:
+            if starts.size and starts[0] == 0:
+                lengths[0] += self.run
+            else:
+                # Перенесённая серия закончилась на первом кадре части
+                lengths, ends = np.concatenate(([self.run], lengths)), np.concatenate(([0], ends))
+        self.run = 0
+        if ends.size and ends[-1] == len(values):
+            self.run, lengths = lengths[-1], lengths[:-1]
+        if not lengths.size:
+            return 0.0
+        # Длительность серии из n кадров - n раз прибавленный timestep
+        if lengths.max() > len(self._table):
+            self._table = np.cumsum(np.full(lengths.max(), self.timestep))
+        durations = self._table[lengths - 1]
+        durations = durations[durations > self.min_silence]
+        return float(np.cumsum(durations)[-1]) if durations.size else 0.0
+
+
+def pause_seconds(values, threshold, timestep=TIMESTEP, min_silence=MIN_SILENCE):
+    """Суммарная длительность пауз по всем кадрам интенсивности записи"""
+    return PauseTracker(timestep, min_silence).update(values, threshold)
+
+
+def voice_features(snd):
+    """
+    Признаки голоса для parselmouth.Sound. Высота тона считается один раз и
+    используется и для статистики, и для PointProcess (то же, что
+    "To PointProcess (periodic, cc)", который иначе строит её заново).
+    """
+    pitch = snd.to_pitch(pitch_floor=PITCH_FLOOR, pitch_ceiling=PITCH_CEILING)
+    pitch_values = pitch.selected_array['frequency']
+    voiced = pitch_values[pitch_values > 0]
+    pitch_mean = float(voiced.mean()) if voiced.size > 0 else np.nan
+    pitch_median = float(np.median(voiced)) if voiced.size > 0 else np.nan
+
+    intensity_values = np.ravel(snd.to_intensity().values)
+    loudness = float(intensity_values.mean()) if intensity_values.size > 0 else np.nan
+
+    point_process = call([snd, pitch], "To PointProcess (cc)")
+    voice_impulses = call(point_process, "Get number of points")
+
+    total_duration = snd.get_total_duration()
+    speech_rate = voice_impulses / total_duration if total_duration > 0 else np.nan
+
+    silence_thresh = loudness * SILENCE_RATIO if not np.isnan(loudness) else 0
+    pauses = pause_seconds(intensity_values, silence_thresh)
+    pauses_scaled = pauses / total_duration if total_duration > 0 else np.nan
+
+    jitter = call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
+    shimmer = call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    jitter_perc = float(jitter) if jitter is not None else np.nan
+    shimmer_perc = float(shimmer) if shimmer is not None else np.nan
+    anxiety = np.nanmean([jitter_perc, shimmer_perc])
+
+    return {
+        'pitch_mean': round(pitch_mean, 2),
+        'pitch_median': round(pitch_median, 2),
+        'loudness': round(loudness, 2) if not np.isnan(loudness) else np.nan,
+        'voice_impulses': int(voice_impulses) if not np.isnan(voice_impulses) else np.nan,
+        'pauses_scaled': round(pauses_scaled, 5) if not np.isnan(pauses_scaled) else np.nan,
+        'jitter': round(jitter_perc, 5) if not np.isnan(jitter_perc) else np.nan,
+        'shimmer': round(shimmer_perc, 5) if not np.isnan(shimmer_perc) else np.nan,
+        'anxiety': round(anxiety, 3) if not np.isnan(anxiety) else np.nan,
+        'speech_rate': round(speech_rate, 3) if not np.isnan(speech_rate) else np.nan
+        }
+
+
+def extract_audio_features(audio_file_path):
+    try:
+        logging.info(f"Загрузка файла: {audio_file_path}")
+        return voice_features(parselmouth.Sound(audio_file_path))
+    except Exception as e:
+        logging.error(f"Ошибка при извлечении характеристик: {e}")
+        return None
+
+
+def extract_features_batch(audio_file_paths):
+    """Признаки для списка файлов за один вызов; None - для файлов с ошибкой"""
+    return [extract_audio_features(path) for path in audio_file_paths]
+
+
+# Ряды по окнам в потоковом режиме
+SERIES = ('pitch_mean', 'loudness', 'speech_rate', 'pauses_scaled', 'jitter', 'shimmer')
+
+
+def read_windows(audio_file_path, window_seconds, hop_seconds):
+    """
+    Читает PCM WAV частями по hop_seconds и выдаёт окна по window_seconds:
+    (сигнал окна, частота, время начала окна, время первого нового отсчёта).
+    В памяти - только одно окно; последнее окно - последние window_seconds
+    записи, новые в нём только отсчёты после предыдущего окна.
+    """
+    if not 0 < hop_seconds <= window_seconds:
+        raise ValueError(f"Сдвиг {hop_seconds} с должен быть в (0, {window_seconds}] с")
+    with wave.open(audio_file_path, 'rb') as f:
+        sr, channels, width = f.getframerate(), f.getnchannels(), f.getsampwidth()
+        dtype = {1: np.uint8, 2: '<i2', 4: '<i4'}[width]
+        scale = float(2 ** (8 * width - 1))
+        window, hop = int(round(window_seconds * sr)), int(round(hop_seconds * sr))
+        buf, read = np.empty(0), 0
+        size = window
+        while True:
+            chunk = np.frombuffer(f.readframes(size), dtype=dtype).astype(np.float64)
+            if not chunk.size:
+                break
+            if width == 1:
+                chunk -= 128
+            chunk = chunk.reshape(-1, channels).mean(axis=1) / scale
+            buf = np.concatenate((buf, chunk))[-window:]
+            read += len(chunk)
+            yield buf, sr, (read - len(buf)) / sr, (read - len(chunk)) / sr
+            size = hop
+
+
+def weighted_mean(values, weights):
+    """Среднее по окнам с определённым значением и ненулевым весом"""
+    ok = np.isfinite(values) & (weights > 0)
+    return float(np.average(values[ok], weights=weights[ok])) if ok.any() else np.nan
+
+
+class VoiceWindows:
+    """
+    Признаки голоса по окнам одной записи.
+
+    add() считает признаки окна (для рядов - по всему окну) и накапливает
+    кадры, новые относительно предыдущих окон: из них в summary()
+    получаются сводные поля с теми же именами, что у voice_features для
+    всей записи. Хранятся только кадры высоты тона и интенсивности (~100 в
+    секунду), а не сигнал. Паузы считаются по потоку кадров с переносом
+    незавершённой серии между окнами.
+
+    jitter и shimmer записи - средние по окнам с весом по числу новых
+    импульсов, а не значения Praat по всему файлу: разности соседних
+    периодов на стыках окон и нормировка на средний период всей записи не
+    учитываются, и значения могут заметно отличаться (на синтетическом
+    голосе 70 с jitter 0.00218 против 0.00300 по всему файлу). Модель
+    усталости audiofat обучена на значениях по всему файлу.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.series = {name: [] for name in SERIES}
+        self.voiced = []
+        self.intensity = []
+        self.impulses = 0
+        self.duration = 0.0
+        self.perturbation = []  # (новых импульсов, jitter, shimmer)
+        self.pauses = PauseTracker()
+        self._loudness_sum, self._loudness_count = 0.0, 0
+
+    def add(self, snd, new_from):
+        """Добавляет окно snd, новые отсчёты которого начинаются с new_from; возвращает признаки окна"""
+        pitch = snd.to_pitch(pitch_floor=PITCH_FLOOR, pitch_ceiling=PITCH_CEILING)
+        intensity = snd.to_intensity()
+        point_process = call([snd, pitch], "To PointProcess (cc)")
+        jitter = call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
+        shimmer = call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+        impulses = call(point_process, "Get number of points")
+
+        pitch_values = pitch.selected_array['frequency']
+        intensity_values = np.ravel(intensity.values)
+        new_pitch = pitch_values[pitch.xs() >= new_from]
+        new_intensity = intensity_values[intensity.xs() >= new_from]
+        new_impulses = impulses - (call(point_process, "Get low index", new_from) if new_from > snd.xmin else 0)
+        self.voiced.append(new_pitch[new_pitch > 0])
+        self.intensity.append(new_intensity)
+        self.impulses += new_impulses
+        new_duration = snd.xmax - new_from
+        self.duration += new_duration
+        self.perturbation.append((new_impulses, jitter, shimmer))
+
+        # Порог тишины - от средней громкости записи на данный момент
+        self._loudness_sum += new_intensity.sum()
+        self._loudness_count += new_intensity.size
+        loudness_so_far = self._loudness_sum / self._loudness_count if self._loudness_count else np.nan
+        pauses = self.pauses.update(new_intensity, loudness_so_far * SILENCE_RATIO if self._loudness_count else 0)
+
+        voiced = pitch_values[pitch_values > 0]
+        features = {
+            'pitch_mean': round(float(voiced.mean()), 2) if voiced.size else np.nan,
+            'loudness': round(float(intensity_values.mean()), 2) if intensity_values.size else np.nan,
+            'speech_rate': round(impulses / snd.get_total_duration(), 3),
+            'pauses_scaled': round(pauses / new_duration, 5) if new_duration > 0 else np.nan,
+            'jitter': round(float(jitter), 5),
+            'shimmer': round(float(shimmer), 5),
+        }
+        self.starts.append(round(snd.xmin, 3))
+        for name in SERIES:
+            self.series[name].append(features[name])
+        return dict(features, window_start=self.starts[-1])
+
+    def summary(self):
+        voiced = np.concatenate(self.voiced) if self.voiced else np.empty(0)
+        intensity_values = np.concatenate(self.intensity) if self.intensity else np.empty(0)
+        pitch_mean = float(voiced.mean()) if voiced.size > 0 else np.nan
+        pitch_median = float(np.median(voiced)) if voiced.size > 0 else np.nan
+        loudness = float(intensity_values.mean()) if intensity_values.size > 0 else np.nan
+        total_duration = self.duration
+        speech_rate = self.impulses / total_duration if total_duration > 0 else np.nan
+        silence_thresh = loudness * SILENCE_RATIO if not np.isnan(loudness) else 0
+        pauses = pause_seconds(intensity_values, silence_thresh)
+        pauses_scaled = pauses / total_duration if total_duration > 0 else np.nan
+
+        perturbation = np.array(self.perturbation, dtype=float).reshape(-1, 3)
+        jitter_perc = weighted_mean(perturbation[:, 1], perturbation[:, 0])
+        shimmer_perc = weighted_mean(perturbation[:, 2], perturbation[:, 0])
+        anxiety = np.nanmean([jitter_perc, shimmer_perc])
+
+        summary = {
+            'pitch_mean': round(pitch_mean, 2),
+            'pitch_median': round(pitch_median, 2),
+            'loudness': round(loudness, 2) if not np.isnan(loudness) else np.nan,
+            'voice_impulses': int(self.impulses),
+            'pauses_scaled': round(pauses_scaled, 5) if not np.isnan(pauses_scaled) else np.nan,
+            'jitter': round(jitter_perc, 5) if not np.isnan(jitter_perc) else np.nan,
+            'shimmer': round(shimmer_perc, 5) if not np.isnan(shimmer_perc) else np.nan,
+            'anxiety': round(anxiety, 3) if not np.isnan(anxiety) else np.nan,
+            'speech_rate': round(speech_rate, 3) if not np.isnan(speech_rate) else np.nan,
+            'windows': len(self.starts),
+            'window_start': self.starts,
+        }
+        for name, values in self.series.items():
+            summary[f"series_{name}"] = values
+        return summary
+
+
+def stream_features(audio_file_path, window_seconds, hop_seconds, windows=None):
+    """
+    Признаки по окнам по мере чтения записи: генератор признаков окон.
+    Сводные поля накапливаются в windows (VoiceWindows).
+    """
+    windows = windows if windows is not None else VoiceWindows()
+    for signal, sr, start, new_from in read_windows(audio_file_path, window_seconds, hop_seconds):
+        yield windows.add(parselmouth.Sound(signal, sampling_frequency=sr, start_time=start), new_from)
+
+
+def extract_stream_features(audio_file_path, window_seconds, hop_seconds):
+    """Потоковый режим: сводные поля записи и ряды по окнам; не-PCM WAV - целиком"""
+    try:
+        logging.info(f"Загрузка файла окнами по {window_seconds} с: {audio_file_path}")
+        windows = VoiceWindows()
+        try:
+            for window in stream_features(audio_file_path, window_seconds, hop_seconds, windows):
+                logging.debug(f"Окно {window['window_start']} с: {window}")
+        except (wave.Error, KeyError) as e:
+            logging.warning(f"Запись не читается частями ({e}), признаки по всему файлу")
+            return voice_features(parselmouth.Sound(audio_file_path))
+        if not windows.starts:
+            logging.error(f"Пустая запись: {audio_file_path}")
+            return None
+        return windows.summary()
+    except Exception as e:
+        logging.error(f"Ошибка при извлечении характеристик: {e}")
+        return None
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class WindowScores:
+    """
+    Накопление результатов моделей по окнам одной записи.
+
+    Для каждой модели эмоций хранятся вероятности всех меток по окнам
+    (метки вне top_k пайплайна считаются нулевыми), для VAD - значения по
+    окнам. summary() сводит их в формат одного прохода модели: средние
+    вероятности по убыванию (для существующих полей *_internal_audio /
+    *_external_audio / valence_audio) плюс максимумы и ряды по окнам.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.labels = {'internal': [], 'external': []}
+        self.scores = {'internal': [], 'external': []}
+        self.top_k = {}
+        self.vad = []
+
+    def _add_result(self, model, res):
+        labels = self.labels[model]
+        for emo in res:
+            if emo['label'] not in labels:
+                labels.append(emo['label'])
+        row = dict.fromkeys(labels, 0.0)
+        row.update((emo['label'], emo['score']) for emo in res)
+        self.scores[model].append(row)
+        self.top_k[model] = len(res)
+
+    def add(self, start, res_int, res_ext, vad):
+        self.starts.append(round(start, 3))
+        self._add_result('internal', res_int)
+        self._add_result('external', res_ext)
+        self.vad.append(vad)
+
+    def _matrix(self, model):
+        labels = self.labels[model]
+        return labels, np.array([[row.get(label, 0.0) for label in labels] for row in self.scores[model]])
+
+    def _mean_result(self, model):
+        labels, matrix = self._matrix(model)
+        mean = matrix.mean(axis=0)
+        order = np.argsort(-mean)[:self.top_k[model]]
+        return [{'label': labels[i], 'score': float(mean[i])} for i in order]
+
+    def summary(self):
+        """Возвращает (res_int, res_ext, vad) по всем окнам и словарь дополнительных полей"""
+        extra = {'windows_audio': len(self.starts), 'window_start_audio': self.starts}
+        for model in ('internal', 'external'):
+            labels, matrix = self._matrix(model)
+            for label, column in zip(labels, matrix.T):
+                extra[f"max_{label}_{model}_audio".lower()] = float(column.max())
+                extra[f"series_{label}_{model}_audio".lower()] = column.round(4).tolist()
+        vad = np.array(self.vad)
+        for name, column in zip(('valence', 'arousal', 'dominance'), vad.T):
+            extra[f"max_{name}_audio"] = float(column.max())
+            extra[f"series_{name}_audio"] = column.round(4).tolist()
+        return self._mean_result('internal'), self._mean_result('external'), vad.mean(axis=0).tolist(), extra
@@ -3,11 +3,16 @@ import logging
 import pika
 import json
 import os
-import numpy as np
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import mlflow.transformers
 from transformers import AutoProcessor, AutoModelForAudioClassification
 import torch
-import torchaudio
+from prometheus_client import Histogram, start_http_server
+from preprocess import AudioPreprocessor
+from aggregate import WindowScores
+from emotion_scoring import to_matrix, emotion_fields
+from artifacts import ArtifactStore
 
 
 EXCHANGE = 'audioemo'
@@ -17,6 +22,31 @@ INT_EMO_MODEL_PATH = 'model_int'
 EXT_EMO_MODEL_PATH = 'model_ext'
 DOM_MODEL_PATH = 'model_dom'
 
+# Движок инференса: torch или onnx (модели из export_onnx.py в AUDIOEMO_ONNX_DIR)
+BACKEND = os.getenv("AUDIOEMO_BACKEND", "torch")
+ONNX_DIR = os.getenv("AUDIOEMO_ONNX_DIR", "onnx")
+ONNX_QUANTIZED = os.getenv("AUDIOEMO_ONNX_QUANTIZED", "0") == "1"
+# Потоки onnxruntime внутри оператора и между операторами (0 - по умолчанию)
+ORT_INTRA_THREADS = int(os.getenv("ORT_INTRA_THREADS", "0"))
+ORT_INTER_THREADS = int(os.getenv("ORT_INTER_THREADS", "0"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Пачка: до AUDIOEMO_BATCH_SIZE сообщений или AUDIOEMO_BATCH_WAIT_MS ожидания
+BATCH_SIZE = int(os.getenv("AUDIOEMO_BATCH_SIZE", "8"))
+BATCH_WAIT = float(os.getenv("AUDIOEMO_BATCH_WAIT_MS", "200")) / 1000
+# Неподтверждённых сообщений у потребителя; не меньше размера пачки
+PREFETCH_COUNT = max(int(os.getenv("AUDIOEMO_PREFETCH", str(BATCH_SIZE * 2))), BATCH_SIZE)
+
+# Окна длинных записей: длина и сдвиг в секундах (0 - весь файл одним окном)
+WINDOW_SECONDS = float(os.getenv("AUDIOEMO_WINDOW_SEC", "10"))
+HOP_SECONDS = float(os.getenv("AUDIOEMO_HOP_SEC", "5"))
+
+# Длительность этапов: декодирование - на окно, модели - на пачку окон
+STAGE_SECONDS = Histogram('audioemo_stage_seconds', 'Длительность этапа обработки аудио', ['stage'])
+BATCH_SIZE_OBSERVED = Histogram('audioemo_batch_size', 'Число окон в пачке, переданной моделям',
+                                buckets=(1, 2, 4, 8, 16, 32, 64))
+
 
 logging.basicConfig(level=logging.INFO,    
                     format='%(asctime)s - %(levelname)s - %(module)s - %(message)s'
@@ -34,148 +64,67 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Оценки по окнам - производный артефакт аудио: при повторной доставке
+# записи с теми же моделями и окнами модели не запускаются
+store = ArtifactStore(DATA_DIR)
+SCORES_PARAMS = {'backend': BACKEND, 'quantized': ONNX_QUANTIZED, 'window': WINDOW_SECONDS, 'hop': HOP_SECONDS}
 
 
 
-# Весовые коэффициенты для валентности
-valence_map = {
-    "Angry": -0.7,
-    "Disgusted": -0.6,
-    "Happy": 0.8,
-    "Neutral": 0.0,
-    "Sad": -0.8,
-    "Scared": -0.7,
-    "Surprised": 0.3
-}
 
-# Весовые коэффициенты для активации
-arousal_map = {
-    "Angry": 0.8,
-    "Disgusted": 0.4,
-    "Happy": 0.7,
-    "Neutral": 0.0,
-    "Sad": -0.5,
-    "Scared": 0.9,
-    "Surprised": 0.9
-}
-# Создаем pipeline для инференса
-emo_int =  mlflow.transformers.load_model(INT_EMO_MODEL_PATH) 
-emo_ext =  mlflow.transformers.load_model(EXT_EMO_MODEL_PATH) 
-#emo_dom =  mlflow.transformers.load_model(DOM_MODEL_PATH) 
+# Все три модели получают один и тот же сигнал 16 кГц
+SAMPLE_RATE = 16000
+preprocessor = AudioPreprocessor(SAMPLE_RATE)
 
-processor = AutoProcessor.from_pretrained(DOM_MODEL_PATH)
-model = AutoModelForAudioClassification.from_pretrained(DOM_MODEL_PATH)
-model.eval().to("cuda" if torch.cuda.is_available() else "cpu")
+if BACKEND == "onnx":
+    from onnx_backend import OnnxAudioModel
+    onnx_options = dict(quantized=ONNX_QUANTIZED, intra_threads=ORT_INTRA_THREADS, inter_threads=ORT_INTER_THREADS)
+    # Те же вызовы и формат результата, что у пайплайнов transformers
+    emo_int = OnnxAudioModel(os.path.join(ONNX_DIR, "int"), **onnx_options)
+    emo_ext = OnnxAudioModel(os.path.join(ONNX_DIR, "ext"), **onnx_options)
+    dom_model = OnnxAudioModel(os.path.join(ONNX_DIR, "dom"), max_length=SAMPLE_RATE * 10, **onnx_options)
+    logging.info(f"Модели загружены из {ONNX_DIR} (onnxruntime, int8={ONNX_QUANTIZED})")
+else:
+    # Создаем pipeline для инференса
+    emo_int =  mlflow.transformers.load_model(INT_EMO_MODEL_PATH) 
+    emo_ext =  mlflow.transformers.load_model(EXT_EMO_MODEL_PATH) 
+    #emo_dom =  mlflow.transformers.load_model(DOM_MODEL_PATH) 
 
+    processor = AutoProcessor.from_pretrained(DOM_MODEL_PATH)
+    model = AutoModelForAudioClassification.from_pretrained(DOM_MODEL_PATH)
+    model.eval().to("cuda" if torch.cuda.is_available() else "cpu")
 
-# Создаём функцию callback для обработки данных из очереди
-def callback(ch, method, properties, body):
-    logging.info(f'Получено сообщение - {body}')
-    message = json.loads(body)
-    user_id = message['user_id']
-    audio_file = message['audio_file']
-    tstamp = message['timestamp']
-    res = emo_int(DATA_DIR+"/"+audio_file)
+
+def annotate(message, res_int, res_ext, vad, fields_int, fields_ext):
+    """
+    Дополняет сообщение результатами трёх моделей; fields_int/fields_ext -
+    производные признаки из emotion_fields, посчитанные сразу для всей пачки.
+    """
+    res = res_int
     logging.info(f'Внутренние эмоции - {res}')
     message["emotion_internal_audio"] = res[0]['label']
     message["confidence_internal_audio"] =  res[0]['score']
     for i in res:
         message[f"{i['label']}_internal_audio".lower()] = i['score']
-     
-    message["valence_classic_internal_audio"]= sum(emo['score'] * valence_map[emo['label']] for emo in res)
-    message["arousal_classic_internal_audio"] = sum(emo['score'] * arousal_map[emo['label']] for emo in res)
-    
+    message.update(fields_int)
 
-    res = emo_ext(DATA_DIR+"/"+audio_file)
+    res = res_ext
     logging.info(f'Внешние эмоции - {res}')
     message["emotion_external_audio"] = res[0]['label']
     message["confidence_external_audio"] =  res[0]['score']
     for i in res:
         message[f"{i['label']}_external_audio".lower()] = i['score']
-     
-    message["valence_classic_external_audio"]= sum(emo['score'] * valence_map[emo['label']] for emo in res)
-    message["arousal_classic_external_audio"] = sum(emo['score'] * arousal_map[emo['label']] for emo in res)
-
-   # res = emo_dom(DATA_DIR+"/"+audio_file)
-    logging.info(f'доминированиа - {res}')
-    # for i in res:
-    #     message[f"{i['label']}_audio"] = i['score']
-        
-    waveform, sr = torchaudio.load(DATA_DIR+"/"+audio_file)
-
-    # Усреднение каналов при необходимости
-    if waveform.shape[0] > 1:
-        waveform = waveform.mean(dim=0, keepdim=True)
-
-    # Приведение к 16 кГц
-    if sr != 16000:
-        waveform = torchaudio.transforms.Resample(orig_freq=sr, new_freq=16000)(waveform)
-
-    # Подготовка входов
-    inputs = processor(
-        waveform.squeeze().numpy(),
-        sampling_rate=16000,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=16000 * 10
-    )
-    inputs = {k: v.to(model.device) for k, v in inputs.items()}
-
-    # Предсказание
-    with torch.no_grad():
-        logits = model(**inputs).logits
+    message.update(fields_ext)
+    # Поле исторически публикуется под этим именем (так называется столбец chunks_new)
+    message["max_positive_external_audiot"] = message.pop("max_positive_external_audio")
 
     # Извлечение значений
-    valence, arousal, dominance = logits[0].cpu().numpy().tolist()
+    valence, arousal, dominance = vad
 
     message["valence_audio"] = valence
     message["arousal_audio"] = arousal
     message["dominance_audio"] = dominance    
     
-    logging.info(f"Модели отработали")
-    
-    
-    # Позитивные и негативные эмоции
-    pos = ["happy_external_audio"]
-    neg = ["angry_external_audio", "scared_external_audio", "disgusted_external_audio", "sad_external_audio"]
-
-    if message["valence_classic_external_audio"] > 0.1:
-        pos.append("surprised_external_audio")
-    elif message["valence_classic_external_audio"] < -0.1:
-        neg.append("surprised_external_audio")
-
-    pos_vals = [ message[emo] for emo in pos]
-    neg_vals = [ message[emo] for emo in neg]
-
-    message["mean_positive_external_audio"] = np.mean(pos_vals)
-    message["min_positive_external_audio"] = np.min(pos_vals)
-    message["max_positive_external_audiot"] = np.max(pos_vals)
-    message["mean_negative_external_audio"] = np.mean(neg_vals)
-    message["min_negative_external_audio"] = np.min(neg_vals)
-    message["max_negative_external_audio"] = np.max(neg_vals)
-    
-    
-    # Позитивные и негативные эмоции
-    pos = ["happy_internal_audio"]
-    neg = ["angry_internal_audio", "scared_internal_audio", "disgusted_internal_audio", "sad_internal_audio"]
-
-    if message["valence_classic_internal_audio"] > 0.1:
-        pos.append("surprised_internal_audio")
-    elif message["valence_classic_internal_audio"] < -0.1:
-        neg.append("surprised_internal_audio")
-
-    pos_vals = [ message[emo] for emo in pos]
-    neg_vals = [ message[emo] for emo in neg]
-
-    message["mean_positive_internal_audio"] = np.mean(pos_vals)
-    message["min_positive_internal_audio"] = np.min(pos_vals)
-    message["max_positive_internal_audio"] = np.max(pos_vals)
-    message["mean_negative_internal_audio"] = np.mean(neg_vals)
-    message["min_negative_internal_audio"] = np.min(neg_vals)
-    message["max_negative_internal_audio"] = np.max(neg_vals)        
-        
-    
     int_emo  = message.get("emotion_internal_audio")
     ext_emo  = message.get("emotion_external_audio")
     conf_int = (message.get("confidence_internal_audio") or 0)
@@ -207,24 +156,204 @@ def callback(ch, method, properties, body):
         hidden = int_emo
 
     message["hidden_emotion_audio"] = hidden
-        
-    message['user_id'] = user_id
-    message['timestamp']  = tstamp
-   
 
 
-    channel.basic_publish(
-        exchange = EXCHANGE,
-        routing_key = '',
-        body=json.dumps(message))
+def run_models(audios):
+    """
+    Прогоняет пачку сигналов через все три модели, каждую один раз на пачку.
+    Возвращает по каждому сигналу результаты внутренней, внешней моделей и VAD.
+    """
+    inputs = [{"raw": audio, "sampling_rate": SAMPLE_RATE} for audio in audios]
+    # Пайплайны сами дополняют сигналы до общей длины внутри пачки
+    with STAGE_SECONDS.labels('emo_int').time():
+        res_int = emo_int(inputs, batch_size=len(inputs))
+    with STAGE_SECONDS.labels('emo_ext').time():
+        res_ext = emo_ext(inputs, batch_size=len(inputs))
+
+    with STAGE_SECONDS.labels('dominance').time():
+        vad = dominance_logits(audios).tolist()
+    return zip(res_int, res_ext, vad)
+
+
+def dominance_logits(audios):
+    """Валентность, активация и доминирование для пачки сигналов"""
+    if BACKEND == "onnx":
+        return dom_model.logits(audios, SAMPLE_RATE)
+    # Подготовка входов: дополнение до самого длинного сигнала пачки
+    features = processor(
+        audios,
+        sampling_rate=SAMPLE_RATE,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=SAMPLE_RATE * 10
+    )
+    features = {k: v.to(model.device) for k, v in features.items()}
 
+    # Предсказание
+    with torch.no_grad():
+        logits = model(**features).logits
+    return logits.cpu().numpy()
+
+
+# Сообщения, ожидающие обработки пачкой: (delivery_tag, message)
+batch = []
+batch_started = None
+# Модели работают в отдельном потоке, по одной пачке за раз; поток
+# соединения RabbitMQ не блокируется на время инференса
+scorer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audioemo-models')
+
+
+def score_windows(pending):
+    """
+    Читает записи сообщений окнами и прогоняет окна через модели пачками по
+    BATCH_SIZE (окна соседних сообщений попадают в одну пачку). В памяти
+    одновременно не больше одной пачки окон. Возвращает по сообщению
+    накопленные WindowScores или None, если запись не удалось прочитать.
+    """
+    scores = [WindowScores() for _ in pending]
+    windows = []  # (индекс сообщения, начало окна, сигнал 16 кГц)
+
+    def flush():
+        started = time.perf_counter()
+        results = run_models([audio for _, _, audio in windows])
+        for (index, start, _), result in zip(windows, results):
+            if scores[index] is not None:
+                scores[index].add(start, *result)
+        STAGE_SECONDS.labels('models').observe(time.perf_counter() - started)
+        BATCH_SIZE_OBSERVED.observe(len(windows))
+        windows.clear()
+
+    for index, (_, message) in enumerate(pending):
+        audio_file = message['audio_file']
+        stream = preprocessor.windows(DATA_DIR+"/"+audio_file, WINDOW_SECONDS, HOP_SECONDS)
+        count = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                window = next(stream, None)
+                if window is None:
+                    break
+                STAGE_SECONDS.labels('decode').observe(time.perf_counter() - started)
+                start, waveform, sr = window
+                with STAGE_SECONDS.labels('resample').time():
+                    windows.append((index, start, preprocessor.resample(waveform, sr)))
+                count += 1
+                if len(windows) >= BATCH_SIZE:
+                    flush()
+        except Exception as e:
+            logging.error(f"Не удалось декодировать {audio_file}: {e}")
+            scores[index] = None
+            continue
+        if count == 0:
+            logging.error(f"Пустая запись {audio_file}")
+            scores[index] = None
+    if windows:
+        flush()
+    return scores
+
+
+def score_batch(pending):
+    """
+    Оценки по окнам для сообщений пачки: из хранилища или через модели.
+    Выполняется в потоке моделей; возвращает по сообщению сводку или None.
+    """
+    keys = [message.get('audio_key') and store.derive(message['audio_key'], 'audioemo', SCORES_PARAMS)
+            for _, message in pending]
+    summaries = [store.load_json(key) if key else None for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    scores = score_windows([pending[i] for i in missing])
+    logging.info(f"Модели отработали, сообщений в пачке - {len(missing)} из {len(pending)}")
+    for i, windows in zip(missing, scores):
+        if windows is not None:
+            # Существующие поля - средние по окнам, плюс максимумы и ряды по окнам
+            summaries[i] = windows.summary()
+            if keys[i]:
+                store.save_json(keys[i], summaries[i])
+    return summaries
+
+
+def process_batch():
+    """
+    Передаёт накопленную пачку в поток моделей. Длинные записи оцениваются
+    минутами: поток соединения тем временем обслуживает heartbeat и
+    принимает следующую пачку, а результаты публикуются в нём же по готовности.
+    """
+    global batch, batch_started
+    pending, batch, batch_started = batch, [], None
+    if not pending:
+        return
+    future = scorer.submit(score_batch, pending)
+    done = functools.partial(publish_batch, pending)
+    future.add_done_callback(
+        lambda f: connection.add_callback_threadsafe(functools.partial(done, f)))
+
+
+def publish_batch(pending, future):
+    """Публикует результаты пачки и подтверждает сообщения; выполняется в потоке соединения"""
+    try:
+        summaries = future.result()
+    except Exception as e:
+        logging.error(f"Ошибка обработки пачки из {len(pending)} сообщений: {e}")
+        for tag, _ in pending:
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+        return
+
+    done = []
+    for (tag, message), summary in zip(pending, summaries):
+        if summary is None:
+            channel.basic_nack(delivery_tag=tag, requeue=False)
+        else:
+            done.append((tag, message, summary))
+    if not done:
+        return
+    # Валентность, активация и позитивные/негативные эмоции - матрично на всю пачку
+    fields_int = emotion_fields(to_matrix([summary[0] for _, _, summary in done]), "internal_audio")
+    fields_ext = emotion_fields(to_matrix([summary[1] for _, _, summary in done]), "external_audio")
+
+    for (tag, message, (res_int, res_ext, vad, extra)), f_int, f_ext in zip(done, fields_int, fields_ext):
+        annotate(message, res_int, res_ext, vad, f_int, f_ext)
+        message.update(extra)
+        channel.basic_publish(
+            exchange = EXCHANGE,
+            routing_key = '',
+            body=json.dumps(message))
+        # Подтверждаем только после публикации результата
+        channel.basic_ack(delivery_tag=tag)
     logging.info(f"Аудио успешно обработано")
 
 
+def batch_timer():
+    """Обрабатывает неполную пачку, если первое сообщение ждёт дольше BATCH_WAIT_MS"""
+    if batch_started is None:
+        return
+    remaining = batch_started + BATCH_WAIT - time.monotonic()
+    if remaining > 0:
+        connection.call_later(remaining, batch_timer)
+    else:
+        process_batch()
+
+
+# Создаём функцию callback для обработки данных из очереди
+def callback(ch, method, properties, body):
+    global batch_started
+    logging.info(f'Получено сообщение - {body}')
+    message = json.loads(body)
+
+    # Запись читается окнами уже при обработке пачки
+    batch.append((method.delivery_tag, message))
+    if batch_started is None:
+        batch_started = time.monotonic()
+        connection.call_later(BATCH_WAIT, batch_timer)
+    if len(batch) >= BATCH_SIZE:
+        process_batch()
+
+
 
+channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 channel.queue_declare(queue='extract_aud_emo', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN, queue='extract_aud_emo', routing_key='')
-channel.basic_consume(queue='extract_aud_emo', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='extract_aud_emo', on_message_callback=callback, auto_ack=False)
 
 
 
@@ -234,4 +363,5 @@ channel.basic_consume(queue='extract_aud_emo', on_message_callback=callback, aut
 if __name__ == "__main__":
     # Запускаем режим ожидания прихода сообщений
     logging.info(f"Сервис извлечения эмоций из аудио стартует...")
+    start_http_server(METRICS_PORT)
     channel.start_consuming()
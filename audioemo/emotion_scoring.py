@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Фиксированный порядок эмоций: столбцы матриц вероятностей
+EMOTIONS = ("Angry", "Disgusted", "Happy", "Neutral", "Sad", "Scared", "Surprised")
+EMOTION_INDEX = {emo.lower(): i for i, emo in enumerate(EMOTIONS)}
+
+# Весовые коэффициенты для валентности и активации в порядке EMOTIONS
+VALENCE_WEIGHTS = np.array([-0.7, -0.6, 0.8, 0.0, -0.8, -0.7, 0.3])
+AROUSAL_WEIGHTS = np.array([0.8, 0.4, 0.7, 0.0, -0.5, 0.9, 0.9])
+
+# Позитивные и негативные эмоции; удивление относится к ним по знаку валентности
+POSITIVE = np.isin(EMOTIONS, ["Happy"])
+NEGATIVE = np.isin(EMOTIONS, ["Angry", "Scared", "Disgusted", "Sad"])
+SURPRISED = np.isin(EMOTIONS, ["Surprised"])
+SURPRISE_THRESHOLD = 0.1
+
+
+def to_matrix(results):
+    """
+    Матрица вероятностей (n, len(EMOTIONS)) из результатов классификаторов:
+    списков [{"label", "score"}, ...] (пайплайны transformers) или словарей
+    {метка: вероятность}. Регистр меток не важен, отсутствующие метки - 0.
+    """
+    matrix = np.zeros((len(results), len(EMOTIONS)))
+    for row, result in zip(matrix, results):
+        items = result.items() if isinstance(result, dict) else ((r['label'], r['score']) for r in result)
+        for label, score in items:
+            index = EMOTION_INDEX.get(label.lower())
+            if index is not None:
+                row[index] = score
+    return matrix
+
+
+def classic_scores(scores):
+    """Классические валентность и активация: взвешенные суммы вероятностей по строкам"""
+    return scores @ VALENCE_WEIGHTS, scores @ AROUSAL_WEIGHTS
+
+
+def polarity_stats(scores, valence):
+    """
+    Среднее, минимум и максимум вероятностей позитивных и негативных эмоций
+    по строкам. Удивление считается позитивным при valence > 0.1 и
+    негативным при valence < -0.1.
+    """
+    valence = np.asarray(valence, dtype=float).reshape(-1, 1)
+    positive = POSITIVE | (SURPRISED & (valence > SURPRISE_THRESHOLD))
+    negative = NEGATIVE | (SURPRISED & (valence < -SURPRISE_THRESHOLD))
+    stats = {}
+    for name, mask in (("positive", positive), ("negative", negative)):
+        stats[f"mean_{name}"] = (scores * mask).sum(axis=1) / mask.sum(axis=1)
+        stats[f"min_{name}"] = np.where(mask, scores, np.inf).min(axis=1)
+        stats[f"max_{name}"] = np.where(mask, scores, -np.inf).max(axis=1)
+    return stats
+
+
+def emotion_fields(scores, suffix, valence=None, classic=True):
+    """
+    Поля сообщения по каждой строке scores: valence_classic_<suffix>,
+    arousal_classic_<suffix> (при classic) и mean/min/max_positive/negative_<suffix>.
+    Для разделения удивления берётся valence, по умолчанию - классическая.
+    Значения - обычные float, готовые к json.dumps.
+    """
+    classic_valence, classic_arousal = classic_scores(scores)
+    columns = {}
+    if classic:
+        columns[f"valence_classic_{suffix}"] = classic_valence
+        columns[f"arousal_classic_{suffix}"] = classic_arousal
+    stats = polarity_stats(scores, classic_valence if valence is None else valence)
+    columns.update((f"{name}_{suffix}", values) for name, values in stats.items())
+    rows = [{} for _ in range(len(scores))]
+    for name, values in columns.items():
+        for row, value in zip(rows, values.tolist()):
+            row[name] = value
+    return rows
@@ -0,0 +1,154 @@
+"""
+Офлайн-экспорт моделей audioemo в ONNX и проверка совпадения с PyTorch.
+
+Запуск внутри образа audioemo (каталоги моделей смонтированы как в compose):
+
+    python export_onnx.py --out onnx --quantize
+    python export_onnx.py --out onnx --check data/reference
+
+Для каждой модели (int, ext, dom) создаётся каталог onnx/<имя> с model.onnx,
+при --quantize - model.int8.onnx (динамическое int8-квантование весов),
+конфигурацией извлечения признаков и labels.json. --check прогоняет эталонные
+клипы (*.wav) через PyTorch и onnxruntime и сравнивает результаты.
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+
+import numpy as np
+import torch
+import mlflow.transformers
+from transformers import AutoProcessor, AutoModelForAudioClassification
+
+from preprocess import AudioPreprocessor
+from onnx_backend import OnnxAudioModel, softmax
+
+
+SAMPLE_RATE = 16000
+# Ограничение длины входа модели VAD, как в app.py
+DOM_MAX_LENGTH = SAMPLE_RATE * 10
+
+MODELS = {
+    'int': 'model_int',
+    'ext': 'model_ext',
+    'dom': 'model_dom',
+}
+
+
+def pipeline_top_k(pipe):
+    """
+    Сколько меток возвращает пайплайн при вызове как в app.py: определяется
+    по результату на секунде тишины, без обращения к его внутренним полям
+    """
+    return len(pipe(np.zeros(SAMPLE_RATE, dtype=np.float32)))
+
+
+def load_torch(name, path, top_k=None):
+    """
+    Возвращает модель PyTorch, извлекатель признаков и top_k: заданный явно
+    или тот, с которым отвечает пайплайн (для VAD - None)
+    """
+    if name == 'dom':
+        processor = AutoProcessor.from_pretrained(path)
+        feature_extractor = getattr(processor, 'feature_extractor', processor)
+        return AutoModelForAudioClassification.from_pretrained(path), feature_extractor, None
+    pipe = mlflow.transformers.load_model(path)
+    return pipe.model, pipe.feature_extractor, top_k or pipeline_top_k(pipe)
+
+
+def export(name, path, out_dir, quantize, opset, top_k=None):
+    model, feature_extractor, top_k = load_torch(name, path, top_k)
+    model.eval().to('cpu')
+    model_dir = os.path.join(out_dir, name)
+    os.makedirs(model_dir, exist_ok=True)
+
+    # Пример входа: две секунды тишины, пачка и длина - динамические оси
+    features = feature_extractor([np.zeros(SAMPLE_RATE * 2, dtype=np.float32)],
+                                 sampling_rate=SAMPLE_RATE, return_tensors='pt')
+    input_names = [n for n in ('input_values', 'attention_mask') if n in features]
+    dynamic_axes = {n: {0: 'batch', 1: 'samples'} for n in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+    onnx_path = os.path.join(model_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(features[n] for n in input_names), onnx_path,
+                          input_names=input_names, output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    print(f"{name}: {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(model_dir, 'model.int8.onnx')
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"{name}: {int8_path}")
+
+    feature_extractor.save_pretrained(model_dir)
+    id2label = model.config.id2label
+    with open(os.path.join(model_dir, 'labels.json'), 'w') as f:
+        json.dump({'labels': [id2label[i] for i in range(len(id2label))], 'top_k': top_k}, f)
+
+
+def torch_logits(model, feature_extractor, audio, max_length):
+    kwargs = {'max_length': max_length, 'truncation': True} if max_length else {}
+    features = feature_extractor(audio, sampling_rate=SAMPLE_RATE, return_tensors='pt', **kwargs)
+    with torch.no_grad():
+        return model(**features).logits[0].numpy()
+
+
+def check(name, path, out_dir, clips, quantized, tolerance):
+    """
+    Сравнивает выходы PyTorch и ONNX на эталонных клипах: для классификаторов -
+    вероятности и совпадение самой вероятной эмоции, для VAD - значения.
+    Возвращает True, если расхождение не больше tolerance и метки совпали.
+    """
+    model, feature_extractor, _ = load_torch(name, path)
+    model.eval().to('cpu')
+    max_length = DOM_MAX_LENGTH if name == 'dom' else None
+    onnx_model = OnnxAudioModel(os.path.join(out_dir, name), quantized=quantized, max_length=max_length)
+    preprocessor = AudioPreprocessor(SAMPLE_RATE)
+
+    worst, mismatched = 0.0, 0
+    for clip in clips:
+        audio = preprocessor.resample(*preprocessor.decode(clip))
+        expected = torch_logits(model, feature_extractor, audio, max_length)
+        actual = onnx_model.logits([audio], SAMPLE_RATE)[0]
+        if name != 'dom':
+            expected, actual = softmax(expected), softmax(actual)
+            mismatched += int(np.argmax(expected) != np.argmax(actual))
+        worst = max(worst, float(np.max(np.abs(expected - actual))))
+    ok = worst <= tolerance and mismatched == 0
+    print(f"{name}: клипов {len(clips)}, макс. расхождение {worst:.5f}, "
+          f"несовпадений метки {mismatched} - {'OK' if ok else 'ОШИБКА'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=os.getenv('AUDIOEMO_ONNX_DIR', 'onnx'), help='каталог для ONNX-моделей')
+    parser.add_argument('--models', default='int,ext,dom', help='какие модели обрабатывать')
+    parser.add_argument('--quantize', action='store_true', help='дополнительно сохранить int8-версию')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='сколько эмоций возвращать (по умолчанию - как пайплайн модели)')
+    parser.add_argument('--check', metavar='DIR', help='только проверить совпадение на клипах *.wav из DIR')
+    parser.add_argument('--quantized', action='store_true', help='проверять int8-версию')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='допустимое расхождение (по умолчанию 1e-3, для int8 - 5e-2)')
+    args = parser.parse_args()
+    names = [n.strip() for n in args.models.split(',') if n.strip()]
+
+    if args.check:
+        clips = sorted(glob.glob(os.path.join(args.check, '*.wav')))
+        if not clips:
+            sys.exit(f"В {args.check} нет эталонных клипов *.wav")
+        tolerance = args.tolerance if args.tolerance is not None else (5e-2 if args.quantized else 1e-3)
+        results = [check(n, MODELS[n], args.out, clips, args.quantized, tolerance) for n in names]
+        sys.exit(0 if all(results) else 1)
+
+    for name in names:
+        export(name, MODELS[name], args.out, args.quantize, args.opset, args.top_k)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import json
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoFeatureExtractor
+
+
+def model_file(model_dir, quantized=False):
+    return os.path.join(model_dir, "model.int8.onnx" if quantized else "model.onnx")
+
+
+def create_session(path, intra_threads=0, inter_threads=0):
+    """Сессия onnxruntime на CPU; 0 потоков - значение onnxruntime по умолчанию"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_threads
+    options.inter_op_num_threads = inter_threads
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxAudioModel:
+    """
+    Модель аудио-классификации, экспортированная export_onnx.py.
+
+    Каталог модели содержит model.onnx (и model.int8.onnx после квантования),
+    конфигурацию извлечения признаков и labels.json с порядком меток и top_k
+    исходного пайплайна.
+    """
+
+    def __init__(self, model_dir, quantized=False, intra_threads=0, inter_threads=0, max_length=None):
+        self.session = create_session(model_file(model_dir, quantized), intra_threads, inter_threads)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.feature_extractor = AutoFeatureExtractor.from_pretrained(model_dir)
+        with open(os.path.join(model_dir, "labels.json")) as f:
+            meta = json.load(f)
+        self.labels = meta["labels"]
+        self.top_k = meta.get("top_k") or len(self.labels)
+        self.max_length = max_length
+
+    def logits(self, audios, sampling_rate):
+        """Логиты для пачки сигналов, дополненных до самого длинного"""
+        kwargs = {"max_length": self.max_length, "truncation": True} if self.max_length else {}
+        features = self.feature_extractor(audios, sampling_rate=sampling_rate, padding=True,
+                                          return_tensors="np", **kwargs)
+        feeds = {name: features[name] for name in self.input_names}
+        return self.session.run(None, feeds)[0]
+
+    def __call__(self, inputs, batch_size=None):
+        """
+        Совместимый с пайплайном transformers вызов: для списка входов
+        {"raw", "sampling_rate"} возвращает по каждому список
+        [{"label", "score"}, ...] по убыванию вероятности.
+        """
+        single = isinstance(inputs, dict)
+        if single:
+            inputs = [inputs]
+        results = []
+        batch_size = batch_size or len(inputs)
+        for start in range(0, len(inputs), batch_size):
+            part = inputs[start:start + batch_size]
+            probs = softmax(self.logits([i["raw"] for i in part], part[0]["sampling_rate"]))
+            for row in probs:
+                order = np.argsort(-row)[:self.top_k]
+                results.append([{"label": self.labels[i], "score": float(row[i])} for i in order])
+        return results[0] if single else results
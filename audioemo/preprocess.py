@@ -0,0 +1,67 @@
+import torch
+import torchaudio
+
+
+class AudioPreprocessor:
+    """
+    Общая подготовка аудио для всех моделей эмоций.
+
+    Файл декодируется один раз, каналы усредняются, а частота приводится к
+    target_rate. Ресемплер строится один раз на каждую исходную частоту и
+    переиспользуется между сообщениями: его ядро фильтра вычисляется при
+    создании и для типичных 48/44.1 кГц не меняется.
+    """
+
+    def __init__(self, target_rate=16000):
+        self.target_rate = target_rate
+        self.resamplers = {}
+
+    def decode(self, path):
+        """Декодирует файл; возвращает моно-сигнал (1, N) и его частоту"""
+        waveform, sr = torchaudio.load(path)
+        # Усреднение каналов при необходимости
+        if waveform.shape[0] > 1:
+            waveform = waveform.mean(dim=0, keepdim=True)
+        return waveform, sr
+
+    def windows(self, path, window_seconds=0, hop_seconds=0):
+        """
+        Последовательно читает файл окнами window_seconds со сдвигом hop_seconds.
+        Выдаёт (начало окна в секундах, моно-сигнал (1, N), частота); в памяти
+        одновременно только одно окно. При window_seconds=0 выдаёт весь файл
+        одним окном.
+        """
+        if not window_seconds:
+            waveform, sr = self.decode(path)
+            yield 0.0, waveform, sr
+            return
+        info = torchaudio.info(path)
+        sr = info.sample_rate
+        window = int(window_seconds * sr)
+        hop = max(int(hop_seconds * sr), 1) if hop_seconds else window
+        start = 0
+        while True:
+            waveform, _ = torchaudio.load(path, frame_offset=start, num_frames=window)
+            if waveform.shape[1] == 0:
+                break
+            if waveform.shape[0] > 1:
+                waveform = waveform.mean(dim=0, keepdim=True)
+            yield start / sr, waveform, sr
+            # Последнее окно дошло до конца файла
+            if waveform.shape[1] < window or (info.num_frames and start + window >= info.num_frames):
+                break
+            start += hop
+
+    def resampler(self, sr):
+        resampler = self.resamplers.get(sr)
+        if resampler is None:
+            resampler = torchaudio.transforms.Resample(orig_freq=sr, new_freq=self.target_rate)
+            self.resamplers[sr] = resampler
+        return resampler
+
+    def resample(self, waveform, sr):
+        """Приводит моно-сигнал к target_rate; возвращает одномерный float32 numpy-массив"""
+        if sr != self.target_rate:
+            with torch.no_grad():
+                waveform = self.resampler(sr)(waveform)
+        return waveform.squeeze(0).numpy()
@@ -0,0 +1,120 @@
+"""
+Время извлечения признаков голоса в audfeat на записях 1, 5 и 30 минут.
+
+До: паузы считаются циклом Python по кадрам интенсивности, высота тона
+строится дважды (to_pitch и внутри "To PointProcess (periodic, cc)").
+После: features.voice_features - паузы через NumPy по границам серий,
+один объект Pitch для статистики и PointProcess.
+
+    python benchmarks/audfeat_features.py                 # синтетическая речь
+    python benchmarks/audfeat_features.py data/a.wav ...  # свои записи
+
+Синтетическая запись - гармонический голос 16 кГц моно с плавающим тоном,
+паузами и шумом. Кроме времени проверяется совпадение признаков.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import parselmouth
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'audfeat'))
+from features import voice_features, extract_features_batch
+
+
+def before(snd):
+    pitch = snd.to_pitch()
+    pitch_values = pitch.selected_array['frequency']
+    voiced = pitch_values[pitch_values > 0]
+    intensity_values = np.ravel(snd.to_intensity().values)
+    loudness = float(intensity_values.mean())
+    point_process = parselmouth.praat.call(snd, "To PointProcess (periodic, cc)", 75, 500)
+    voice_impulses = parselmouth.praat.call(point_process, "Get number of points")
+    total_duration = snd.get_total_duration()
+    pauses, cur_pause = 0.0, 0.0
+    for val in intensity_values:
+        if val < loudness * 0.2:
+            cur_pause += 0.01
+        else:
+            if cur_pause > 0.15:
+                pauses += cur_pause
+            cur_pause = 0.0
+    jitter = parselmouth.praat.call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
+    shimmer = parselmouth.praat.call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+    return {
+        'pitch_mean': round(float(voiced.mean()), 2),
+        'pitch_median': round(float(np.median(voiced)), 2),
+        'loudness': round(loudness, 2),
+        'voice_impulses': int(voice_impulses),
+        'pauses_scaled': round(pauses / total_duration, 5),
+        'jitter': round(float(jitter), 5),
+        'shimmer': round(float(shimmer), 5),
+        'speech_rate': round(voice_impulses / total_duration, 3),
+    }
+
+
+def synthetic(path, minutes, sr=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        # Поминутно, чтобы не держать в памяти всю запись
+        for minute in range(minutes):
+            t = minute * 60 + np.arange(sr * 60) / sr
+            f0 = 150 + 40 * np.sin(2 * np.pi * 0.3 * t) + 10 * np.sin(2 * np.pi * 2.1 * t)
+            phase = 2 * np.pi * np.cumsum(f0) / sr
+            voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+            speaking = np.sin(2 * np.pi * 0.37 * t) + 0.5 * np.sin(2 * np.pi * 0.11 * t) > -0.4
+            signal = 0.3 * voice * speaking + 0.00005 * rng.standard_normal(len(t))
+            f.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+
+
+def measure(run, path):
+    started = time.perf_counter()
+    result = run(parselmouth.Sound(path))
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='WAV-файлы (по умолчанию - синтетические 1, 5 и 30 минут)')
+    parser.add_argument('--minutes', type=int, nargs='+', default=[1, 5, 30])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        files = args.files
+        if not files:
+            files = [os.path.join(work_dir, f'{m}min.wav') for m in args.minutes]
+            for path, minutes in zip(files, args.minutes):
+                synthetic(path, minutes)
+        report = []
+        for path in files:
+            old_time, old = measure(before, path)
+            new_time, new = measure(voice_features, path)
+            minutes = parselmouth.Sound(path).get_total_duration() / 60
+            same = all(old[k] == new[k] for k in old)
+            report.append({'file': os.path.basename(path), 'minutes': round(minutes, 2),
+                           'before_seconds': round(old_time, 3), 'after_seconds': round(new_time, 3),
+                           'same_features': same})
+            print(f"{os.path.basename(path)}: {minutes:.1f} мин, до {old_time:.2f} с, после {new_time:.2f} с, "
+                  f"ускорение {old_time / new_time:.2f}x, признаки {'совпадают' if same else 'различаются'}")
+            if not same:
+                print('  до:   ', old, '\n  после:', new)
+        started = time.perf_counter()
+        extract_features_batch(files)
+        print(f"Пакетно ({len(files)} файлов): {time.perf_counter() - started:.2f} с")
+        print(json.dumps(report))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Извлечение аудиодорожки в vid2snd: время по часам и пиковая память на
+минуту видео.
+
+До: moviepy.editor.VideoFileClip (ffmpeg-читатели и видео, и аудио) и
+write_audiofile в PCM s16le с исходной частотой. После: один ffmpeg с -vn,
+сразу WAV 16 кГц моно, видеопоток не декодируется.
+
+    python benchmarks/audio_extract.py data/answer.mp4 --repeat 3
+
+Каждый замер выполняется в отдельном процессе. Пиковая память - ru_maxrss
+из os.wait4: максимум по самому процессу и дождавшимся им дочерним
+процессам (ffmpeg), т.е. наибольший из процессов дерева, а не их сумма.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vid2snd'))
+from media import extract_audio
+
+
+def duration_minutes(video_path):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                          '-of', 'default=noprint_wrappers=1:nokey=1', video_path],
+                         capture_output=True, check=True)
+    return float(out.stdout) / 60
+
+
+def before(video_path, audio_path):
+    from moviepy.editor import VideoFileClip
+
+    clip = VideoFileClip(video_path)
+    clip.audio.write_audiofile(audio_path, codec='pcm_s16le', logger=None)
+    clip.close()
+
+
+def after(video_path, audio_path):
+    extract_audio(video_path, audio_path, 16000, 1)
+
+
+def measure(method, video_path, work_dir):
+    """Время по часам (с) и пиковая память (МБ) одного извлечения в отдельном процессе"""
+    audio_path = os.path.join(work_dir, method + '.wav')
+    wall = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', method, video_path, audio_path])
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - wall
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f"{method}: код завершения {proc.returncode}")
+    # ru_maxrss в Linux - в килобайтах
+    return wall, usage.ru_maxrss / 1024
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--run':
+        _, _, method, video_path, audio_path = sys.argv
+        {'before': before, 'after': after}[method](video_path, audio_path)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='загруженный ответ (mp4/webm)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    minutes = duration_minutes(args.video)
+    results = {'before': [], 'after': []}
+    for _ in range(args.repeat):
+        work_dir = tempfile.mkdtemp()
+        try:
+            for method in results:
+                results[method].append(measure(method, args.video, work_dir))
+        finally:
+            shutil.rmtree(work_dir)
+
+    report = {'minutes': round(minutes, 3)}
+    for name, runs in results.items():
+        wall, rss = np.median(np.array(runs), axis=0)
+        report[name] = {'wall_seconds_per_minute': round(float(wall / minutes), 3),
+                        'peak_rss_mb': round(float(rss), 1)}
+        print(f"{name:>6}: {wall / minutes:.3f} с на минуту видео, пик RSS {rss:.1f} МБ (медиана из {args.repeat})")
+    print(f"Ускорение: {report['before']['wall_seconds_per_minute'] / report['after']['wall_seconds_per_minute']:.1f}x")
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Процессорное время на подготовку медиа одного загруженного ответа.
+
+До: vid2snd извлекает аудио через moviepy, videoemo заново полностью
+декодирует то же видео через OpenCV. После: один проход ffmpeg в vid2snd
+(WAV + прореженный архив кадров), videoemo читает кадры из архива через
+np.memmap. Модели не запускаются - сравнивается только декодирование.
+
+    python benchmarks/media_cpu.py data/answer.mp4 --repeat 3
+
+Учитывается время пользователя и системы самого процесса и дочерних
+процессов (ffmpeg), т.е. суммарные CPU-секунды, а не время по часам.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vid2snd'))
+from media import prepare_media
+
+
+def cpu_seconds():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def measure(run):
+    cpu, wall = cpu_seconds(), time.perf_counter()
+    run()
+    return cpu_seconds() - cpu, time.perf_counter() - wall
+
+
+def before(video_path, work_dir):
+    import cv2
+    from moviepy.editor import VideoFileClip
+
+    # vid2snd: аудиодорожка через moviepy
+    clip = VideoFileClip(video_path)
+    clip.audio.write_audiofile(os.path.join(work_dir, 'before.wav'), codec='pcm_s16le', logger=None)
+    clip.close()
+    # videoemo: полное декодирование видео
+    cap = cv2.VideoCapture(video_path)
+    while True:
+        ret, _ = cap.read()
+        if not ret:
+            break
+    cap.release()
+
+
+def after(video_path, work_dir, fps, width):
+    frames_path = os.path.join(work_dir, 'after.frames')
+    # vid2snd: один проход ffmpeg
+    meta = prepare_media(video_path, os.path.join(work_dir, 'after.wav'), frames_path, fps, width)
+    # videoemo: чтение кадров из архива
+    frames = np.memmap(frames_path, dtype=np.uint8, mode='r',
+                       shape=(meta['count'], meta['height'], meta['width'], 3))
+    for frame in frames:
+        frame.sum(dtype=np.uint64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='загруженный ответ (mp4/webm)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fps', type=float, default=10, help='MEDIA_FRAME_FPS')
+    parser.add_argument('--width', type=int, default=640, help='MEDIA_FRAME_WIDTH')
+    args = parser.parse_args()
+
+    results = {'before': [], 'after': []}
+    for _ in range(args.repeat):
+        work_dir = tempfile.mkdtemp()
+        try:
+            results['before'].append(measure(lambda: before(args.video, work_dir)))
+            results['after'].append(measure(lambda: after(args.video, work_dir, args.fps, args.width)))
+        finally:
+            shutil.rmtree(work_dir)
+
+    report = {}
+    for name, runs in results.items():
+        cpu, wall = np.median(np.array(runs), axis=0)
+        report[name] = {'cpu_seconds': round(float(cpu), 3), 'wall_seconds': round(float(wall), 3)}
+        print(f"{name:>6}: CPU {cpu:.3f} с, по часам {wall:.3f} с (медиана из {args.repeat})")
+    print(f"Экономия CPU: {1 - report['after']['cpu_seconds'] / report['before']['cpu_seconds']:.0%}")
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
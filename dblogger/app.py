@@ -4,20 +4,39 @@ import os
 import logging
 import numpy as np
 import psycopg2
-from datetime import datetime
+from prometheus_client import start_http_server
+from batch_writer import BatchWriter
+from row_assembler import RowAssembler
 
 # Читаем переменные окружения
 DB_HOST = os.getenv("DB_HOST", "postgres")
 DB_NAME = os.getenv("DB_NAME", "echodatabase")
 DB_USER = os.getenv("DB_USER", "dbuser")
 
+# Параметры буферизованной записи
+BATCH_MAX_ROWS = int(os.getenv("DBLOGGER_BATCH_ROWS", "200"))      # сброс по размеру буфера
+BATCH_MAX_AGE = float(os.getenv("DBLOGGER_BATCH_AGE", "1.0"))      # сброс по возрасту, секунды
+PREFETCH_COUNT = int(os.getenv("DBLOGGER_PREFETCH", "1000"))       # неподтверждённых сообщений на канал
+FLUSH_TICK = max(BATCH_MAX_AGE / 4, 0.05)
+
+# Параметры сборки строки chunks_new из результатов всех сервисов.
+# videofat по умолчанию не ждём: сейчас он не публикует результатов, а
+# videoemo молчит, если лицо не найдено. Опоздавшие модальности всё равно
+# дописываются в строку upsert'ом, поэтому ожидание короткое
+EXPECTED_MODALITIES = [m.strip() for m in os.getenv(
+    "DBLOGGER_EXPECTED", "text,feat,textemo,audioemo,videoemo,audiofat,video").split(",") if m.strip()]
+ASSEMBLY_TIMEOUT = float(os.getenv("DBLOGGER_ASSEMBLY_TIMEOUT", "20"))  # ожидание недостающих модальностей, секунды
+ASSEMBLY_MAX_ROWS = int(os.getenv("DBLOGGER_ASSEMBLY_MAX_ROWS", "500"))  # строк в памяти сборщика
+
+STATEMENT_CACHE_SIZE = int(os.getenv("DBLOGGER_STATEMENT_CACHE", "32"))  # подготовленных upsert-запросов
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
 # Читаем пароль из файла секрета
 with open("/run/secrets/postgres_password", "r") as f:
     DB_PASSWORD = f.read().strip()
 
 # Подключение к PostgreSQL
 conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST)
-cur = conn.cursor()
 
 
 
@@ -51,11 +70,6 @@ os.makedirs(DATA_DIR, exist_ok=True)
 
 
 
-def convert_timestamp(timestamp):
-    if isinstance(timestamp, (int, float)):  # Если передан UNIX timestamp
-        return datetime.utcfromtimestamp(timestamp)
-    return timestamp  # Если уже datetime или строка
-
 def get_table_columns(conn, table_name):
     with conn.cursor() as cur:
         cur.execute("""
@@ -65,49 +79,13 @@ def get_table_columns(conn, table_name):
         return {row[0] for row in cur.fetchall()}
 
 
-        
-        
-def upsert_chanks(conn, existing_columns, user_id, timestamp, **kwargs):
-    logging.info(f"existing_columns - {existing_columns}")    
-    if not kwargs:
-        return  # Нечего обновлять
-    
-    # Преобразуем timestamp в datetime, если он передан как число
-    timestamp = convert_timestamp(timestamp)    
-    
-    # Фильтруем только существующие колонки
-    valid_columns = {col: val for col, val in kwargs.items() if col in existing_columns}
-    if not valid_columns:
-        return  # Нет подходящих колонок для обновления
-    logging.info(f"valid_columns - {valid_columns}")    
-    
-    columns = list(valid_columns.keys())
-    values = list(valid_columns.values())
-    
-    insert_columns = ', '.join(['user_id', 'timestamp'] + columns)
-    insert_placeholders = ', '.join(['%s', '%s'] + ['%s'] * len(columns))
-    update_assignments = ', '.join([f"{col} = EXCLUDED.{col}" for col in columns])
-    
-    query = f"""
-        INSERT INTO chunks_new ({insert_columns})
-        VALUES ({insert_placeholders})
-        ON CONFLICT (user_id, timestamp) DO UPDATE SET {update_assignments};
-    """
-    
-    with conn.cursor() as cur:
-        cur.execute(query, [user_id, timestamp] + values)
-        conn.commit()        
-
 existing_columns = get_table_columns(conn, 'chunks_new')  # Получаем список колонок один раз за сессию
 
 
 logging.info(f'Существующие колонки БД - {existing_columns}')
 
 
-def insert_self_report(conn, report_data):
-    # Преобразуем timestamp
-    report_data["timestamp"] = convert_timestamp(report_data.get("timestamp"))
-
+def normalize_self_report(report_data):
     # Очистим значения: "" → None, строковые числа → int
     for key, value in report_data.items():
         if isinstance(value, str):
@@ -115,88 +93,109 @@ def insert_self_report(conn, report_data):
                 report_data[key] = None
             elif value.isdigit():
                 report_data[key] = int(value)
+    return report_data
 
-    query = """
-        INSERT INTO self_reports (
-            user_id, timestamp,
-            joy, sadness, anger, surprise,
-            stress_level, fatigue, anxiety,
-            current_state, previous_state,
-            health_issues, event_details,
-            fatigue_reason, stress_reason, anxiety_reason,
-            stress_duration, fatigue_duration, anxiety_duration
-        ) VALUES (
-            %(user_id)s, %(timestamp)s,
-            %(joy)s, %(sadness)s, %(anger)s, %(surprise)s,
-            %(stress_level)s, %(fatigue)s, %(anxiety)s,
-            %(current_state)s, %(previous_state)s,
-            %(health_issues)s, %(event_details)s,
-            %(fatigue_reason)s, %(stress_reason)s, %(anxiety_reason)s,
-            %(stress_duration)s, %(fatigue_duration)s, %(anxiety_duration)s
-        );
-    """
 
-    with conn.cursor() as cur:
-        cur.execute(query, report_data)
-        conn.commit()
+def ack_messages(tags):
+    for tag in tags:
+        channel.basic_ack(delivery_tag=tag)
+
+
+def nack_messages(tags, requeue):
+    for tag in tags:
+        channel.basic_nack(delivery_tag=tag, requeue=requeue)
+
+
+# Буферизованная запись: сообщения подтверждаются только после коммита
+writer = BatchWriter(
+    connect=lambda: psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST),
+    existing_columns=existing_columns,
+    max_rows=BATCH_MAX_ROWS,
+    max_age=BATCH_MAX_AGE,
+    on_commit=ack_messages,
+    on_failure=nack_messages,
+    statement_cache_size=STATEMENT_CACHE_SIZE,
+)
+
+
+# Сборка строки из всех модальностей перед записью
+assembler = RowAssembler(
+    expected=EXPECTED_MODALITIES,
+    emit=writer.add_chunk,
+    timeout=ASSEMBLY_TIMEOUT,
+    max_rows=ASSEMBLY_MAX_ROWS,
+)
+
+
+def flush_timer():
+    """Периодический выпуск просроченных строк и сброс буфера по возрасту записей."""
+    assembler.expire()
+    if writer.due() or writer.full():
+        writer.flush()
+    connection.call_later(FLUSH_TICK, flush_timer)
 
 
-   
-    
-    
 def callback(ch, method, properties, body):
     logging.info(f'Получено сообщение - {body}')
     if isinstance(body, bytes):
         body = json.loads(body.decode('utf-8'))
     
     if 'stress_duration' in body or 'current_state' in body:  # Признак формы самоотчета
-        insert_self_report(conn, body)
+        writer.add_self_report(normalize_self_report(body), method.delivery_tag)
     else:
-        upsert_chanks(conn=conn, existing_columns=existing_columns, **body)
+        user_id = body.pop('user_id')
+        timestamp = body.pop('timestamp')
+        # Модальность определяем по обменнику, из которого пришло сообщение
+        assembler.add(method.exchange, user_id, timestamp, body, method.delivery_tag)
+    if writer.full():
+        writer.flush()
             
 
+channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 
 channel.queue_declare(queue='log_text_emo', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN4, queue='log_text_emo', routing_key='')
-channel.basic_consume(queue='log_text_emo', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_text_emo', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_vid_emo', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN6, queue='log_vid_emo', routing_key='')
-channel.basic_consume(queue='log_vid_emo', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_vid_emo', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_aud_emo', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN5, queue='log_aud_emo', routing_key='')
-channel.basic_consume(queue='log_aud_emo', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_aud_emo', on_message_callback=callback, auto_ack=False)
 
 
 channel.queue_declare(queue='log_text', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN2, queue='log_text', routing_key='')
-channel.basic_consume(queue='log_text', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_text', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_feat', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN3, queue='log_feat', routing_key='')
-channel.basic_consume(queue='log_feat', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_feat', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_video', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN1, queue='log_video', routing_key='')
-channel.basic_consume(queue='log_video', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_video', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_self_report', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN_SELF_REPORT, queue='log_self_report', routing_key='')
-channel.basic_consume(queue='log_self_report', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_self_report', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_vid_fat', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN7, queue='log_vid_fat', routing_key='')
-channel.basic_consume(queue='log_vid_fat', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_vid_fat', on_message_callback=callback, auto_ack=False)
 
 channel.queue_declare(queue='log_aud_fat', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN8, queue='log_aud_fat', routing_key='')
-channel.basic_consume(queue='log_aud_fat', on_message_callback=callback, auto_ack=True)
+channel.basic_consume(queue='log_aud_fat', on_message_callback=callback, auto_ack=False)
 
 
 if __name__ == "__main__":
     # Запускаем режим ожидания прихода сообщений
     logging.info(f"Сервис логгирования стартует...")
+    start_http_server(METRICS_PORT)
+    connection.call_later(FLUSH_TICK, flush_timer)
     channel.start_consuming()
     
     
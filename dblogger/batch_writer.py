@@ -0,0 +1,191 @@
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_batch, execute_values
+
+from statement_cache import StatementCache
+
+
+CHUNKS_TABLE = 'chunks_new'
+
+SELF_REPORT_COLUMNS = (
+    'user_id', 'timestamp',
+    'joy', 'sadness', 'anger', 'surprise',
+    'stress_level', 'fatigue', 'anxiety',
+    'current_state', 'previous_state',
+    'health_issues', 'event_details',
+    'fatigue_reason', 'stress_reason', 'anxiety_reason',
+    'stress_duration', 'fatigue_duration', 'anxiety_duration',
+)
+
+
+def convert_timestamp(timestamp):
+    if isinstance(timestamp, (int, float)):  # Если передан UNIX timestamp
+        return datetime.utcfromtimestamp(timestamp)
+    return timestamp  # Если уже datetime или строка
+
+
+class BatchWriter:
+    """
+    Буферизованная запись (write-behind) в PostgreSQL.
+
+    Частичные строки chunks_new копятся в памяти по ключу (user_id, timestamp),
+    наборы колонок сливаются, а затем сбрасываются одним многострочным
+    пакетом подготовленных INSERT ... ON CONFLICT DO UPDATE (по одному
+    запросу на сигнатуру колонок, см. StatementCache) в рамках одной транзакции. Сброс происходит по размеру буфера (max_rows) или по
+    возрасту самой старой записи (max_age, секунды).
+
+    Вместе с каждой записью хранятся delivery_tag сообщений RabbitMQ:
+    после коммита они передаются в on_commit (ack), при ошибке - в on_failure
+    (nack), так что доставка остаётся at-least-once.
+    """
+
+    def __init__(self, connect, existing_columns, max_rows=200, max_age=1.0,
+                 on_commit=None, on_failure=None, statement_cache_size=32):
+        self.connect = connect
+        self.existing_columns = existing_columns
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.on_commit = on_commit or (lambda tags: None)
+        self.on_failure = on_failure or (lambda tags, requeue: None)
+        self.conn = connect()
+        self.statements = StatementCache(CHUNKS_TABLE, capacity=statement_cache_size)
+        self.pending = OrderedDict()  # (user_id, timestamp) -> {'columns': {...}, 'tags': [...]}
+        self.reports = []             # [(report_data, delivery_tag)]
+        self.oldest = None            # время поступления самой старой записи в буфере
+
+    def __len__(self):
+        return len(self.pending) + len(self.reports)
+
+    def _touch(self):
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+
+    def add_chunk(self, user_id, timestamp, columns, delivery_tags=()):
+        """Добавляет (частичную) строку chunks_new в буфер, сливая колонки по ключу."""
+        valid_columns = {col: val for col, val in columns.items() if col in self.existing_columns}
+        key = (user_id, convert_timestamp(timestamp))
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = {'columns': {}, 'tags': []}
+        entry['columns'].update(valid_columns)
+        entry['tags'].extend(delivery_tags)
+        self._touch()
+
+    def add_self_report(self, report_data, delivery_tag=None):
+        """Добавляет самоотчёт в буфер (в self_reports он только вставляется)."""
+        row = {col: report_data.get(col) for col in SELF_REPORT_COLUMNS}
+        row['timestamp'] = convert_timestamp(row['timestamp'])
+        self.reports.append((row, delivery_tag))
+        self._touch()
+
+    def full(self):
+        return len(self) >= self.max_rows
+
+    def due(self):
+        return self.oldest is not None and time.monotonic() - self.oldest >= self.max_age
+
+    def _write_chunks(self, cur, items):
+        # Группируем строки по сигнатуре колонок: один подготовленный запрос на группу,
+        # все EXECUTE группы уходят на сервер одним пакетом
+        groups = {}
+        for (user_id, timestamp), entry in items:
+            if not entry['columns']:
+                continue  # Нет подходящих колонок для обновления
+            groups.setdefault(frozenset(entry['columns']), []).append((user_id, timestamp, entry['columns']))
+        for signature, rows in groups.items():
+            columns, execute_sql = self.statements.get(cur, signature)
+            params = [[user_id, timestamp] + [values[col] for col in columns] for user_id, timestamp, values in rows]
+            execute_batch(cur, execute_sql, params, page_size=len(params))
+
+    def _write_reports(self, cur, rows):
+        query = f"INSERT INTO self_reports ({', '.join(SELF_REPORT_COLUMNS)}) VALUES %s;"
+        template = '(' + ', '.join(f"%({col})s" for col in SELF_REPORT_COLUMNS) + ')'
+        execute_values(cur, query, rows, template=template, page_size=len(rows))
+
+    def _reconnect(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = self.connect()
+        self.statements.clear()
+
+    def flush(self):
+        """Сбрасывает буфер в БД одной транзакцией и подтверждает сообщения."""
+        if not len(self):
+            return
+        items = list(self.pending.items())
+        reports = self.reports
+        self.pending = OrderedDict()
+        self.reports = []
+        self.oldest = None
+
+        tags = [tag for _, entry in items for tag in entry['tags']]
+        tags += [tag for _, tag in reports if tag is not None]
+        started = time.monotonic()
+        try:
+            with self.conn.cursor() as cur:
+                if items:
+                    self._write_chunks(cur, items)
+                if reports:
+                    self._write_reports(cur, [row for row, _ in reports])
+            self.conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Потеряно соединение - переподключаемся, сообщения вернутся в очередь
+            logging.error(f"Потеряно соединение с БД при сбросе буфера: {e}")
+            self._reconnect()
+            self.on_failure(tags, True)
+            return
+        except psycopg2.Error as e:
+            logging.error(f"Ошибка пакетной записи ({len(items)} строк, {len(reports)} самоотчётов): {e}")
+            self.conn.rollback()
+            self.statements.invalidate()
+            self._flush_one_by_one(items, reports, tags)
+            return
+        logging.info(f"Записано {len(items)} строк и {len(reports)} самоотчётов "
+                     f"за {time.monotonic() - started:.3f} с")
+        self.on_commit(tags)
+
+    def _flush_one_by_one(self, items, reports, tags):
+        """Построчная запись с точками сохранения, чтобы изолировать «битые» строки."""
+        ok_tags, bad_tags = [], []
+        try:
+            with self.conn.cursor() as cur:
+                for item in items:
+                    item_tags = item[1]['tags']
+                    try:
+                        cur.execute("SAVEPOINT row_write")
+                        self._write_chunks(cur, [item])
+                        ok_tags += item_tags
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        raise
+                    except psycopg2.Error as e:
+                        logging.error(f"Строка {item[0]} отброшена: {e}")
+                        cur.execute("ROLLBACK TO SAVEPOINT row_write")
+                        self.statements.invalidate()
+                        bad_tags += item_tags
+                for row, tag in reports:
+                    item_tags = [tag] if tag is not None else []
+                    try:
+                        cur.execute("SAVEPOINT row_write")
+                        self._write_reports(cur, [row])
+                        ok_tags += item_tags
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        raise
+                    except psycopg2.Error as e:
+                        logging.error(f"Самоотчёт {row.get('user_id')} отброшен: {e}")
+                        cur.execute("ROLLBACK TO SAVEPOINT row_write")
+                        bad_tags += item_tags
+            self.conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logging.error(f"Потеряно соединение с БД при построчной записи: {e}")
+            self._reconnect()
+            self.on_failure(tags, True)
+            return
+        self.on_commit(ok_tags)
+        if bad_tags:
+            self.on_failure(bad_tags, False)
@@ -0,0 +1,75 @@
+import time
+import logging
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from batch_writer import convert_timestamp
+
+
+ROWS_PENDING = Gauge('dblogger_assembler_pending_rows', 'Строки, ожидающие недостающие модальности')
+ROWS_RELEASED = Counter('dblogger_assembler_rows_total', 'Собранные строки по причине выпуска', ['outcome'])
+MODALITIES_MISSING = Counter('dblogger_assembler_missing_modality_total',
+                             'Модальности, не пришедшие до выпуска строки', ['modality'])
+ASSEMBLY_SECONDS = Histogram('dblogger_assembler_assembly_seconds', 'Время от первой модальности до выпуска строки',
+                             buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+
+
+class RowAssembler:
+    """
+    Сборщик строки chunks_new из частичных результатов разных сервисов.
+
+    Частичные наборы колонок копятся по ключу (user_id, timestamp), пока не
+    придут все ожидаемые модальности (имена обменников) или не истечёт
+    timeout с момента прихода первой. Затем строка целиком отдаётся в emit
+    одной записью вместе со всеми delivery_tag её сообщений. При превышении
+    max_rows досрочно выпускается самая старая строка.
+    """
+
+    def __init__(self, expected, emit, timeout=120.0, max_rows=500):
+        self.expected = frozenset(expected)
+        self.emit = emit  # emit(user_id, timestamp, columns, delivery_tags)
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.rows = OrderedDict()  # (user_id, timestamp) -> {'columns', 'tags', 'arrived', 'started'}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, modality, user_id, timestamp, columns, delivery_tag=None):
+        """Добавляет результат одной модальности; выпускает строку, если она собрана."""
+        key = (user_id, convert_timestamp(timestamp))
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = {'columns': {}, 'tags': [], 'arrived': set(), 'started': time.monotonic()}
+        row['columns'].update(columns)
+        row['arrived'].add(modality)
+        if delivery_tag is not None:
+            row['tags'].append(delivery_tag)
+
+        if self.expected <= row['arrived']:
+            self._release(key, 'complete')
+        elif len(self.rows) > self.max_rows:
+            self._release(next(iter(self.rows)), 'evicted')
+        ROWS_PENDING.set(len(self.rows))
+
+    def expire(self):
+        """Выпускает неполные строки, у которых истёк срок ожидания."""
+        now = time.monotonic()
+        while self.rows:
+            key, row = next(iter(self.rows.items()))
+            if now - row['started'] < self.timeout:
+                break
+            self._release(key, 'timeout')
+        ROWS_PENDING.set(len(self.rows))
+
+    def _release(self, key, outcome):
+        row = self.rows.pop(key)
+        ROWS_RELEASED.labels(outcome).inc()
+        ASSEMBLY_SECONDS.observe(time.monotonic() - row['started'])
+        missing = self.expected - row['arrived']
+        for modality in missing:
+            MODALITIES_MISSING.labels(modality).inc()
+        if missing:
+            logging.warning(f"Строка {key} записана без модальностей {sorted(missing)} ({outcome})")
+        self.emit(key[0], key[1], row['columns'], row['tags'])
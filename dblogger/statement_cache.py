@@ -0,0 +1,83 @@
+import logging
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+
+CACHE_HITS = Counter('dblogger_statement_cache_hits_total', 'Попадания в кэш подготовленных upsert-запросов')
+CACHE_MISSES = Counter('dblogger_statement_cache_misses_total', 'Промахи кэша подготовленных upsert-запросов')
+CACHE_EVICTIONS = Counter('dblogger_statement_cache_evictions_total', 'Вытеснения из кэша подготовленных запросов')
+CACHE_SIZE = Gauge('dblogger_statement_cache_size', 'Число подготовленных upsert-запросов в сессии')
+
+
+class StatementCache:
+    """
+    LRU-кэш серверных подготовленных запросов (PREPARE/EXECUTE) для upsert в таблицу.
+
+    Ключ - frozenset допустимых колонок: каждый сервис-источник присылает
+    стабильный набор полей, поэтому SQL строится и разбирается Postgres
+    один раз на сигнатуру, а дальше выполняется только EXECUTE.
+    Подготовленные запросы живут в рамках сессии, поэтому после
+    переподключения кэш нужно сбросить через clear().
+    """
+
+    def __init__(self, table, capacity=32):
+        self.table = table
+        self.capacity = capacity
+        self.entries = OrderedDict()  # frozenset(columns) -> (columns, name, execute_sql)
+        self.counter = 0
+        self.stale = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """Забывает все запросы (новая сессия БД)."""
+        self.entries.clear()
+        self.stale = False
+        CACHE_SIZE.set(0)
+
+    def invalidate(self):
+        """Помечает кэш устаревшим (например, после ROLLBACK); запросы удалятся при следующем обращении."""
+        self.entries.clear()
+        self.stale = True
+        CACHE_SIZE.set(0)
+
+    def get(self, cur, columns):
+        """
+        Возвращает (columns, execute_sql) для набора колонок, подготавливая запрос при промахе.
+        columns в ответе задаёт порядок значений для параметров EXECUTE.
+        """
+        key = frozenset(columns)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            CACHE_HITS.inc()
+            return entry[0], entry[2]
+
+        CACHE_MISSES.inc()
+        if self.stale:
+            cur.execute("DEALLOCATE ALL")
+            self.stale = False
+        if len(self.entries) >= self.capacity:
+            _, (_, old_name, _) = self.entries.popitem(last=False)
+            cur.execute(f"DEALLOCATE {old_name}")
+            CACHE_EVICTIONS.inc()
+
+        ordered = tuple(sorted(key))
+        self.counter += 1
+        name = f"{self.table}_upsert_{self.counter}"
+        insert_columns = ', '.join(('user_id', 'timestamp') + ordered)
+        placeholders = ', '.join(f"${i}" for i in range(1, len(ordered) + 3))
+        update_assignments = ', '.join(f"{col} = EXCLUDED.{col}" for col in ordered)
+        cur.execute(f"""
+            PREPARE {name} AS
+            INSERT INTO {self.table} ({insert_columns})
+            VALUES ({placeholders})
+            ON CONFLICT (user_id, timestamp) DO UPDATE SET {update_assignments};
+        """)
+        execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * (len(ordered) + 2))})"
+        self.entries[key] = (ordered, name, execute_sql)
+        CACHE_SIZE.set(len(self.entries))
+        logging.info(f"Подготовлен запрос {name} для колонок {ordered}")
+        return ordered, execute_sql
@@ -0,0 +1,115 @@
+"""
+Аудио вопросов websrv: файлы, которые пишет tts в хранилище артефактов
+(derived/<aa>/<ключ текста>/speech-<хэш>.wav), отдаются по подписанному
+адресу /question_audio/ только пользователю, которому задан вопрос, в том
+числе после подтверждения вопроса.
+
+RabbitMQ и PostgreSQL подменяются, очередь вопросов - SQLite во временном
+каталоге.
+"""
+import os
+import sys
+import wave
+import builtins
+import importlib
+from unittest import mock
+
+import pytest
+
+
+WEBSRV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'websrv')
+SECRET = '/run/secrets/postgres_password'
+
+
+@pytest.fixture
+def websrv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('QUESTIONS_DB_URI', f"sqlite:///{tmp_path / 'questions.db'}")
+    monkeypatch.syspath_prepend(WEBSRV_DIR)
+    real_open = builtins.open
+
+    def fake_open(path, *args, **kwargs):
+        if path == SECRET:
+            path = tmp_path / 'postgres_password'
+            path.write_text('secret')
+        return real_open(path, *args, **kwargs)
+
+    sys.modules.pop('app', None)
+    with mock.patch('builtins.open', fake_open), \
+            mock.patch('psycopg2.pool.ThreadedConnectionPool'), \
+            mock.patch('pika.BlockingConnection'):
+        module = importlib.import_module('app')
+    # send_from_directory считает DATA_DIR от корня приложения, как в контейнере
+    module.app.root_path = str(tmp_path)
+    yield module
+    sys.modules.pop('app', None)
+
+
+def tts_speech(websrv, text):
+    """Пишет речь так же, как tts/app.py, и возвращает её fname"""
+    from artifacts import digest
+    key = websrv.store.derive(digest(text.encode('utf-8')), 'speech', {'speaker': 'xenia', 'rate': 8000})
+    with websrv.store.write(key, '.wav') as tmp_path:
+        with wave.open(tmp_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(b'\0\0' * 800)
+    return websrv.store.rel(key, '.wav')
+
+
+def add_question(websrv, user_id, fname, text):
+    with websrv.app.app_context():
+        question = websrv.Question(user_id=user_id, file_name=fname, text=text, exit_q=0)
+        websrv.db.session.add(question)
+        websrv.db.session.commit()
+        return websrv.question_queue.push(question)
+
+
+def client_for(websrv, user_id):
+    client = websrv.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+def test_tts_fname_is_served_to_its_user(websrv):
+    fname = tts_speech(websrv, 'Как вы себя чувствуете?')
+    assert '/' in fname
+    question = add_question(websrv, 1, fname, 'Как вы себя чувствуете?')
+    client = client_for(websrv, 1)
+
+    response = client.get('/get_question')
+    assert response.status_code == 200
+    url = response.headers['X-Audio-URL']
+    assert url.endswith(f"/{fname}")
+    assert url == websrv.question_event(question)['audio_url']
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/x-wav'
+    assert 'immutable' in response.headers['Cache-Control']
+
+    # Клиент подтверждает вопрос сразу после начала воспроизведения:
+    # догрузка по Range и повтор из X-Audio-URL должны работать и после этого
+    assert client.post('/ack_question', data={'id': question.id}).status_code == 200
+    assert client.get(url, headers={'Range': 'bytes=0-99'}).status_code == 206
+    assert client.get(url).status_code == 200
+
+
+def test_shared_fname_requires_own_url(websrv):
+    text = 'Вы выспались?'
+    fname = tts_speech(websrv, text)
+    first = add_question(websrv, 1, fname, text)
+    second = add_question(websrv, 2, fname, text)
+    url_1 = websrv.question_event(first)['audio_url']
+    url_2 = websrv.question_event(second)['audio_url']
+    assert url_1 != url_2
+
+    # Тот же файл без подписи или по чужому адресу не отдаётся
+    assert client_for(websrv, 3).get(url_1).status_code == 404
+    assert client_for(websrv, 2).get(url_1).status_code == 404
+    assert client_for(websrv, 1).get(f"/question_audio/{fname}").status_code == 404
+    assert client_for(websrv, 1).get(f"/question_audio/{'0' * 32}/{fname}").status_code == 404
+    assert client_for(websrv, 2).get(url_2).status_code == 200
+    assert client_for(websrv, 1).get(url_1).status_code == 200
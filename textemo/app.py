@@ -2,8 +2,8 @@ import pika
 import json
 import os
 import logging
-import numpy as np
 import mlflow
+from emotion_scoring import to_matrix, emotion_fields
 
 EXCHANGE = 'textemo'
 EXCHANGE_IN = 'text'
@@ -20,29 +20,6 @@ channel = connection.channel()
 
 channel.exchange_declare(exchange=EXCHANGE, exchange_type="fanout")
 
-# Весовые коэффициенты для валентности
-valence_map = {
-    "angry_text": -0.7,
-    "disgusted_text": -0.6,
-    "happy_text": 0.8,
-    "neutral_text": 0.0,
-    "sad_text": -0.8,
-    "scared_text": -0.7,
-    "surprised_text": 0.3
-}
-
-# Весовые коэффициенты для активации
-arousal_map = {
-    "angry_text": 0.8,
-    "disgusted_text": 0.4,
-    "happy_text": 0.7,
-    "neutral_text": 0.0,
-    "sad_text": -0.5,
-    "scared_text": 0.9,
-    "surprised_text": 0.9
-}
-
-
 # Классы эмоций 
 EMOTIONS = ['angry_text', 'disgusted_text', 'happy_text', 'neutral_text', 'sad_text', 'scared_text', 'surprised_text']
 
@@ -67,7 +44,7 @@ def predict_emotions(text: str) -> dict:
     # MultiOutputClassifier возвращает список массивов (для каждого класса)
     # Берем proba[:, 1] для каждого
     scores = [p[0][1] for p in proba_list]
-    return {EMOTIONS[i]: round(scores[i], 4) for i in range(len(EMOTIONS))}
+    return {EMOTIONS[i]: round(float(scores[i]), 4) for i in range(len(EMOTIONS))}
 
 
 
@@ -97,28 +74,9 @@ def callback(ch, method, properties, body):
                 emo_rec+=','
             emo_rec+= emo[:-5].capitalize()
     message["emotions_text"] = emo_rec
-    val = sum(message[emo] * valence_map[emo] for emo in EMOTIONS)        
-    message["valence_classic_text"] = val
-    message["arousal_classic_text"] = sum(message[emo] * arousal_map[emo] for emo in EMOTIONS)
-    
-        # Позитивные и негативные эмоции
-    pos = ["happy_text"]
-    neg = ["angry_text", "scared_text", "disgusted_text", "sad_text"]
-
-    if val > 0.1:
-        pos.append("surprised_text")
-    elif val < -0.1:
-        neg.append("surprised_text")
-
-    pos_vals = [ message[emo] for emo in pos]
-    neg_vals = [ message[emo] for emo in neg]
-
-    message["mean_positive_text"] = np.mean(pos_vals)
-    message["min_positive_text"] = np.min(pos_vals)
-    message["max_positive_text"] = np.max(pos_vals)
-    message["mean_negative_text"] = np.mean(neg_vals)
-    message["min_negative_text"] = np.min(neg_vals)
-    message["max_negative_text"] = np.max(neg_vals)
+    # Валентность, активация и позитивные/негативные эмоции - общий модуль оценки
+    scores = to_matrix([{emo[:-5]: message[emo] for emo in EMOTIONS}])
+    message.update(emotion_fields(scores, "text")[0])
     message["emotion_text_argmax"] = argmax_emo[:-5].capitalize()
 
     logging.info(f"predictions: {message}")
@@ -4,9 +4,12 @@ import os
 import logging
 import numpy as np
 from NeuralSpeaker import NeuralSpeaker
+from publisher import Publisher
 import io
 import wave
 import time
+import subprocess
+from artifacts import ArtifactStore, digest
 
 
 
@@ -15,6 +18,8 @@ EXCHANGE_IN = 'main'
 
 speaker=os.environ.get("SPEAKER",'xenia')
 sample_rate = int(os.environ.get("SAMPLE_RATE",'8000'))
+# Сжатая копия вопроса в OGG/Opus рядом с WAV (пустая строка - отключить)
+opus_bitrate = os.environ.get("OPUS_BITRATE", '32k')
 
 logging.basicConfig(level=logging.INFO,    
                     format='%(asctime)s - %(levelname)s - %(module)s - %(message)s'
@@ -26,6 +31,8 @@ channel = connection.channel()
 
 channel.exchange_declare(exchange = EXCHANGE, exchange_type = "fanout")
 
+publisher = Publisher('rabbitmq')
+
 
 
 neural_speaker = NeuralSpeaker()
@@ -37,9 +44,34 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Синтезированная речь - производный артефакт текста вопроса: одинаковые
+# вопросы с тем же голосом не синтезируются заново
+store = ArtifactStore(DATA_DIR)
+
+
+
 
 
 
+def transcode_opus(wav_path):
+    """
+    Однократно перекодирует WAV вопроса в OGG/Opus рядом с исходным файлом.
+    Пишем во временный файл и переименовываем, чтобы веб-сервер никогда не
+    отдал недописанную копию. При ошибке клиенты получат исходный WAV.
+    """
+    ogg_path = os.path.splitext(wav_path)[0] + '.ogg'
+    if os.path.exists(ogg_path):
+        return
+    tmp_path = ogg_path + '.tmp'
+    try:
+        subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', wav_path,
+                        '-c:a', 'libopus', '-b:a', opus_bitrate, '-application', 'voip',
+                        '-f', 'ogg', tmp_path], check=True)
+        os.replace(tmp_path, ogg_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"tts - не удалось получить OGG/Opus для {wav_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 # Создаём функцию callback для обработки данных из очереди
@@ -48,32 +80,30 @@ def callback(ch, method, properties, body):
     message = json.loads(body)
     user_id = message['user_id']
     text = message['text']
-    audio_data = neural_speaker.speak(words=text, speaker=speaker, save_file=True, sample_rate=sample_rate)
-    str_time = time.strftime("%a_%d_%b_%Y_%H_%M_%S", time.gmtime())
-    fname = f"{user_id}_{str_time}_speak.wav"
+    speech_key = store.derive(digest(text.encode('utf-8')), 'speech', {'speaker': speaker, 'rate': sample_rate})
+    fname = store.lookup(speech_key, '.wav')
+    if fname:
+        logging.info(f"tts -  audio already synthesized - {fname}.")
+    else:
+        audio_data = neural_speaker.speak(words=text, speaker=speaker, save_file=True, sample_rate=sample_rate)
+        fname = store.rel(speech_key, '.wav')
+        logging.info(f"tts -  start write audio - {fname}.")
+        with store.write(speech_key, '.wav') as tmp_path:
+            with wave.open(tmp_path, 'wb') as wav_file:
+                wav_file.setnchannels(1)  # mono
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(sample_rate)
+                wav_file.writeframes(audio_data)
+        logging.info(f"tts -  end write audio - {fname}.")
     audio_path = os.path.join(DATA_DIR, fname)
-    logging.info(f"tts -  start write audio - {audio_path}.")    
-    with wave.open(audio_path, 'wb') as wav_file:
-        wav_file.setnchannels(1)  # mono
-        wav_file.setsampwidth(2)
-        wav_file.setframerate(sample_rate)
-        wav_file.writeframes(audio_data)
-        wav_file.close()
-    logging.info(f"tts -  end write audio - {audio_path}.")    
+    if opus_bitrate:
+        transcode_opus(audio_path)
 
     message['fname'] = fname        
   
 
-    # Открываем новое подключение и канал для публикации
-    connection_pub = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-    channel_pub = connection_pub.channel()
-    channel_pub.exchange_declare(exchange=EXCHANGE, exchange_type="fanout")
-    channel_pub.basic_publish(
-        exchange=EXCHANGE,
-        routing_key='',
-        body=json.dumps(message)
-    )
-    connection_pub.close()
+    # Публикуем через долгоживущее соединение (синтез может идти дольше heartbeat)
+    publisher.publish(EXCHANGE, json.dumps(message))
 
     logging.info(f"сообщение успешно обработано")
 
@@ -0,0 +1,92 @@
+import atexit
+import logging
+import threading
+
+import pika
+from pika.exceptions import AMQPConnectionError, AMQPError, NackError, UnroutableError
+
+
+class Publisher:
+    """
+    Публикация сообщений в RabbitMQ через одно долгоживущее соединение.
+
+    Соединение и канал общие для всех потоков процесса и используются под
+    блокировкой (BlockingConnection не потокобезопасен), поэтому их число не
+    растёт с числом потоков сервера; при выходе процесса соединение
+    закрывается. Канал работает в режиме подтверждений публикации
+    (publisher confirms), а объявленные обменники запоминаются, чтобы не
+    повторять exchange_declare на каждое сообщение.
+
+    Повтор - только если соединение оказалось оборвано до отправки
+    сообщения. Отказ брокера (NackError) или обрыв после отправки
+    пробрасываются без повтора: сообщение могло уже уйти потребителям.
+    """
+
+    def __init__(self, host='rabbitmq', exchange_type='fanout', retries=2):
+        self.parameters = pika.ConnectionParameters(host)
+        self.exchange_type = exchange_type
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        self.declared = set()
+        atexit.register(self.close)
+
+    def _connect(self):
+        """Открытый канал; вызывается под блокировкой"""
+        if self.connection is not None and self.connection.is_open and self.channel.is_open:
+            # Обслуживаем heartbeat простаивавшего соединения и заодно проверяем его
+            self.connection.process_data_events(time_limit=0)
+            return self.channel
+        self._reset()
+        self.connection = pika.BlockingConnection(self.parameters)
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        logging.info("Открыто соединение для публикации")
+        return self.channel
+
+    def _reset(self):
+        connection = self.connection
+        self.connection = self.channel = None
+        self.declared = set()
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except AMQPError:
+                pass
+
+    def _ready(self, exchange):
+        """Канал с объявленным обменником; обрыв соединения - повтор с новым"""
+        for attempt in range(self.retries + 1):
+            try:
+                channel = self._connect()
+                if exchange not in self.declared:
+                    channel.exchange_declare(exchange=exchange, exchange_type=self.exchange_type)
+                    self.declared.add(exchange)
+                return channel
+            except AMQPConnectionError as e:
+                logging.warning(f"Нет соединения для публикации в {exchange} (попытка {attempt + 1}): {e!r}")
+                self._reset()
+                if attempt == self.retries:
+                    raise
+
+    def declare(self, exchange):
+        with self.lock:
+            self._ready(exchange)
+
+    def publish(self, exchange, body, routing_key=''):
+        """Публикует сообщение и ждёт подтверждения брокера."""
+        with self.lock:
+            channel = self._ready(exchange)
+            try:
+                channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body)
+            except AMQPError as e:
+                logging.error(f"Ошибка публикации в {exchange}: {e!r}")
+                if not isinstance(e, (NackError, UnroutableError)):
+                    # Состояние канала после обрыва неизвестно: следующая публикация откроет новый
+                    self._reset()
+                raise
+
+    def close(self):
+        with self.lock:
+            self._reset()
@@ -3,7 +3,9 @@ import logging
 import pika
 import json
 import os
-from moviepy.editor import VideoFileClip
+from prometheus_client import start_http_server
+from media import prepare_media, extract_audio
+from artifacts import ArtifactStore, file_digest
 
 
 EXCHANGE = 'audio'
@@ -25,25 +27,98 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# Функция для извлечения аудиодорожки из видео
-def extract_audio_from_video(video_file, base_path):
-    video_path = os.path.join(base_path, video_file)
-    audio_file = video_file.rsplit(".", 1)[0] + ".wav"# Заменяем расширение на .wav
-    audio_path = os.path.join(base_path, audio_file)  
-
-    if not os.path.exists(audio_path):  # Проверяем, извлечена ли уже аудиодорожка
-        try:
-            logging.info(f"Извлечение аудио из {video_file}...")
-            clip = VideoFileClip(video_path)
-            clip.audio.write_audiofile(audio_path, codec="pcm_s16le")
-            logging.info(f"Аудио успешно сохранено: {audio_path}")
-        except Exception as e:
-            logging.error(f"Ошибка при извлечении аудио из {video_file}: {e}")
-            return None
+# Архив кадров для videoemo из того же прохода ffmpeg (0 - только аудио)
+MEDIA_FRAMES = os.getenv("MEDIA_FRAMES", "1") == "1"
+MEDIA_FRAME_FPS = float(os.getenv("MEDIA_FRAME_FPS", "10"))
+# Ширина и формат кадров - как у детектора лиц videoemo (VIDEO_DETECT_WIDTH, серый):
+# около 0.6 МБ на секунду видео 16:9 вместо 6.9 МБ у BGR 640 px
+MEDIA_FRAME_WIDTH = int(os.getenv("MEDIA_FRAME_WIDTH", "320"))
+MEDIA_FRAME_FORMAT = os.getenv("MEDIA_FRAME_FORMAT", "gray")
+# Формат WAV для всех потребителей: ASR, признаки и эмоции работают с 16 кГц моно
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_CHANNELS = int(os.getenv("AUDIO_CHANNELS", "1"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Хранилище артефактов в DATA_DIR; вытеснение по объёму и возрасту выполняет этот сервис
+store = ArtifactStore(DATA_DIR,
+                      max_bytes=float(os.getenv("ARTIFACT_MAX_GB", "20")) * 1024 ** 3,
+                      max_age=float(os.getenv("ARTIFACT_MAX_AGE_DAYS", "30")) * 86400,
+                      keep_recent=float(os.getenv("ARTIFACT_KEEP_RECENT_SEC", "3600")))
+EVICT_INTERVAL = float(os.getenv("ARTIFACT_EVICT_INTERVAL_SEC", "600"))
+
+
+def read_frames_meta(frames_key):
+    """Описание готового архива кадров или None"""
+    rel = store.lookup(frames_key, '.frames.json', 'frames')
+    if rel is None:
+        return None
+    with open(store.path(rel)) as f:
+        return json.load(f)
+
+
+def prepare_video(video_file, video_key):
+    """
+    Готовит медиа для потребителей за одно декодирование видео: WAV и архив
+    кадров - производные артефакты видео video_key. Уже подготовленные с
+    теми же параметрами не пересчитываются. Возвращает (ключ аудио, путь
+    аудио, путь архива) - путь архива None, если его нет; если общий проход
+    не удался, извлекает только аудио.
+    """
+    audio_key = store.derive(video_key, 'audio', {'rate': AUDIO_SAMPLE_RATE, 'channels': AUDIO_CHANNELS})
+    frames_key = store.derive(video_key, 'frames', {'fps': MEDIA_FRAME_FPS, 'width': MEDIA_FRAME_WIDTH,
+                                                    'format': MEDIA_FRAME_FORMAT}) if MEDIA_FRAMES else None
+    audio_file = store.lookup(audio_key, '.wav')
+    if frames_key is None:
+        frames_meta = None
     else:
-        logging.info(f"Аудиофайл уже существует: {audio_path}")
-
-    return audio_file
+        # Описание архива есть и у видео без кадров или без звука: проход уже выполнен
+        frames_meta = read_frames_meta(frames_key)
+    if frames_key is None and audio_file:
+        logging.info(f"Аудио уже подготовлено: {audio_file}")
+        return audio_key, audio_file, None
+    if frames_meta is not None and (audio_file or not frames_meta.get('has_audio', True)):
+        logging.info(f"Медиа уже подготовлены: {audio_file}, кадров в архиве: {frames_meta['count']}")
+        return audio_key, audio_file, store.rel(frames_key, '.frames')
+    video_path = os.path.join(DATA_DIR, video_file)
+    audio_file = store.rel(audio_key, '.wav')
+    audio_path = store.target(audio_key, '.wav')
+    try:
+        logging.info(f"Подготовка медиа из {video_file}...")
+        meta = prepare_media(video_path, audio_path, frames_key and store.target(frames_key, '.frames'),
+                             MEDIA_FRAME_FPS, MEDIA_FRAME_WIDTH, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS,
+                             MEDIA_FRAME_FORMAT)
+        if meta is None:
+            logging.info(f"Аудио сохранено: {audio_path}")
+            return audio_key, audio_file, None
+        if not meta['has_audio']:
+            logging.warning(f"В {video_file} нет аудиодорожки")
+            audio_file = None
+        logging.info(f"Аудио: {audio_file}, кадров в архиве: {meta['count']}")
+        return audio_key, audio_file, store.rel(frames_key, '.frames')
+    except Exception as e:
+        logging.error(f"Ошибка подготовки медиа из {video_file}: {e}")
+    if frames_key is None:
+        return audio_key, None, None
+    # Без архива кадров: только аудиодорожка, без декодирования видео
+    try:
+        extract_audio(video_path, audio_path, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS)
+        logging.info(f"Аудио сохранено: {audio_path}")
+        return audio_key, audio_file, None
+    except Exception as e:
+        logging.error(f"Ошибка при извлечении аудио из {video_file}: {e}")
+        return audio_key, None, None
+
+
+def evict_timer():
+    """Периодическое вытеснение старых артефактов из общего тома"""
+    try:
+        removed = store.evict()
+        if removed:
+            logging.info(f"Вытеснено артефактов: {removed}")
+    except Exception as e:
+        logging.error(f"Ошибка вытеснения артефактов: {e}")
+    connection.call_later(EVICT_INTERVAL, evict_timer)
 
 
 # Создаём функцию callback для обработки данных из очереди
@@ -53,12 +128,24 @@ def callback(ch, method, properties, body):
     user_id = message['user_id']
     video_file = message['video_file']
     tstamp = message['timestamp']
-
-
-    # Извлечение аудиодорожки из выбранного видеофайла
-    audio_file = extract_audio_from_video(video_file, DATA_DIR)
+    # Сообщения без ключа (загруженные до хранилища) - ключ по содержимому файла
+    video_key = message.get('video_key')
+    if not video_key:
+        try:
+            video_key = file_digest(os.path.join(DATA_DIR, video_file))
+        except OSError as e:
+            # Файл удалён или не читается: сообщение пропускается, потребитель продолжает работу
+            logging.error(f"Не удалось прочитать {video_file}, сообщение пропущено: {e}")
+            return
+    message['video_key'] = video_key
+
+    # Извлечение аудиодорожки и кадров из выбранного видеофайла за один проход
+    audio_key, audio_file, frames_file = prepare_video(video_file, video_key)
     
     message['audio_file'] = audio_file
+    message['audio_key'] = audio_key
+    if frames_file:
+        message['frames_file'] = frames_file
 
     channel.basic_publish(
         exchange = EXCHANGE,
@@ -81,4 +168,6 @@ channel.basic_consume(queue='extract_audio', on_message_callback=callback, auto_
 if __name__ == "__main__":
     # Запускаем режим ожидания прихода сообщений
     logging.info(f"Сервис извлечения аудио стартует...")
+    start_http_server(METRICS_PORT)
+    connection.call_later(EVICT_INTERVAL, evict_timer)
     channel.start_consuming()
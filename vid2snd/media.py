@@ -0,0 +1,131 @@
+import os
+import json
+import subprocess
+from fractions import Fraction
+
+
+def probe(video_path):
+    """
+    Параметры видео по заголовку файла (ffprobe, без декодирования):
+    размер кадра с учётом поворота, частота кадров и наличие звука.
+    """
+    out = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries',
+         'stream=codec_type,width,height,avg_frame_rate,r_frame_rate:stream_tags=rotate:stream_side_data=rotation',
+         '-of', 'json', video_path],
+        capture_output=True, check=True)
+    streams = json.loads(out.stdout).get('streams', [])
+    info = {'has_audio': any(s.get('codec_type') == 'audio' for s in streams), 'width': 0, 'height': 0, 'fps': 0.0}
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        return info
+    width, height = video.get('width', 0), video.get('height', 0)
+    rotation = int(video.get('tags', {}).get('rotate', 0))
+    for side_data in video.get('side_data_list', []):
+        rotation = int(side_data.get('rotation', rotation))
+    # ffmpeg поворачивает кадры при декодировании, размеры меняются местами
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        rate = video.get(key, '0/0')
+        if not rate.endswith('/0'):
+            info['fps'] = float(Fraction(rate))
+            break
+    info.update(width=width, height=height)
+    return info
+
+
+def audio_args(sample_rate=16000, channels=1):
+    """Параметры выходного WAV: PCM s16le, частота и число каналов, которые ждут потребители"""
+    return ['-c:a', 'pcm_s16le', '-ar', str(sample_rate), '-ac', str(channels), '-f', 'wav']
+
+
+def extract_audio(video_path, audio_path, sample_rate=16000, channels=1):
+    """
+    Только аудиодорожка: ffmpeg с -vn демультиплексирует и декодирует один
+    звуковой поток и сразу пишет WAV нужного формата, кадры видео не
+    декодируются. Файл пишется во временный и переименовывается.
+    """
+    audio_tmp = audio_path + '.tmp'
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', video_path,
+               '-vn', '-sn', '-dn', '-map', '0:a:0'] + audio_args(sample_rate, channels) + [audio_tmp]
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(audio_tmp):
+            os.remove(audio_tmp)
+        raise RuntimeError(e.stderr.decode(errors='replace').strip()) from e
+    os.replace(audio_tmp, audio_path)
+
+
+def frame_size(width, height, max_width):
+    """Размер кадров архива: ширина не больше max_width, чётные стороны"""
+    if max_width and width > max_width:
+        height = height * max_width / width
+        width = max_width
+    return int(width) // 2 * 2, int(round(height / 2)) * 2
+
+
+# Форматы архива кадров: байт на пиксель для pix_fmt ffmpeg
+FRAME_FORMATS = {'gray': 1, 'bgr24': 3}
+
+
+def write_frames_meta(frames_path, meta):
+    """Описание архива пишется последним: его наличие означает, что проход завершён"""
+    with open(frames_path + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(frames_path + '.json.tmp', frames_path + '.json')
+
+
+def prepare_media(video_path, audio_path, frames_path=None, frame_fps=10, frame_width=320,
+                  sample_rate=16000, channels=1, frame_format='gray'):
+    """
+    Один проход ffmpeg по загруженному видео: аудиодорожка в WAV (PCM s16le,
+    sample_rate Гц, channels каналов) и, если задан frames_path, прореженные
+    до frame_fps и уменьшенные до frame_width кадры (по умолчанию серые, как
+    их видит детектор лиц videoemo) подряд в одном файле (читается через
+    np.memmap). Без frames_path видео не декодируется.
+
+    Описание архива пишется в frames_path + '.json' последним и тогда, когда
+    кадров или звука в файле нет (count 0, has_audio false): повторная
+    обработка того же видео не запускает ffmpeg заново. Файлы пишутся во
+    временные и переименовываются. Возвращает описание архива или None без
+    frames_path.
+    """
+    if frames_path is None:
+        # Без архива кадров видеопоток не нужен вовсе
+        extract_audio(video_path, audio_path, sample_rate, channels)
+        return None
+    info = probe(video_path)
+    with_frames = info['width'] > 0
+    meta = {'format': frame_format, 'width': 0, 'height': 0, 'fps': 0, 'source_fps': info['fps'],
+            'count': 0, 'has_audio': info['has_audio']}
+    command, temps = [], []
+    if info['has_audio']:
+        audio_tmp = audio_path + '.tmp'
+        command += ['-map', '0:a:0'] + audio_args(sample_rate, channels) + [audio_tmp]
+        temps.append(audio_tmp)
+    if with_frames:
+        width, height = frame_size(info['width'], info['height'], frame_width)
+        fps = min(frame_fps, info['fps']) if frame_fps and info['fps'] else (frame_fps or info['fps'])
+        frames_tmp = frames_path + '.tmp'
+        command += ['-map', '0:v:0', '-vf', f'fps={fps},scale={width}:{height}',
+                    '-pix_fmt', frame_format, '-f', 'rawvideo', frames_tmp]
+        temps.append(frames_tmp)
+        meta.update(width=width, height=height, fps=fps)
+    if command:
+        try:
+            subprocess.run(['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', video_path] + command,
+                           check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            for tmp in temps:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            raise RuntimeError(e.stderr.decode(errors='replace').strip()) from e
+    if info['has_audio']:
+        os.replace(audio_tmp, audio_path)
+    if with_frames:
+        os.replace(frames_tmp, frames_path)
+        meta['count'] = os.path.getsize(frames_path) // (width * height * FRAME_FORMATS[frame_format])
+    write_frames_meta(frames_path, meta)
+    return meta
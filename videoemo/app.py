@@ -5,16 +5,22 @@ import json
 import os
 from moviepy.editor import VideoFileClip
 import numpy as np
-import pandas as pd
 from fer import FER
 import torch
 import torch.nn as nn
-from scipy.stats import trim_mean
-from collections import Counter
 import cv2
+import tensorflow as tf
+from emotion_scoring import to_matrix, emotion_fields
+from faces import FER_LABELS, FaceTracker, face_crop, classify_faces
+from pipeline import FramePipeline
+from framestore import FrameStore, valence_summary
+from prometheus_client import Counter, Histogram, start_http_server
+from artifacts import ArtifactStore
 
 EXCHANGE = 'videoemo'
-EXCHANGE_IN = 'video'
+# Видео приходит после vid2snd: в сообщении уже есть архив кадров frames_file
+EXCHANGE_IN = 'audio'
+EXCHANGE_VIDEO = 'video'
 
 # Emotion labels and column definitions
 EMOTION_MAPPING = {
@@ -43,10 +49,46 @@ DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Итог по видео - производный артефакт архива кадров (или самого видео)
+store = ArtifactStore(DATA_DIR)
 
 
+
+# Частота анализа кадров: VIDEO_ANALYSIS_FPS кадров в секунду видео (0 - по
+# VIDEO_FRAME_STEP: каждый k-й кадр); пропускаемые кадры не декодируются
+ANALYSIS_FPS = float(os.getenv("VIDEO_ANALYSIS_FPS", "10"))
+FRAME_STEP = int(os.getenv("VIDEO_FRAME_STEP", "1"))
+# Ширина кадра для поиска лица (0 - без уменьшения) и минимальный размер лица на нём
+DETECT_WIDTH = int(os.getenv("VIDEO_DETECT_WIDTH", "320"))
+MIN_FACE_SIZE = int(os.getenv("VIDEO_MIN_FACE_SIZE", "25"))
+# Сколько вырезанных лиц классифицируется за один вызов сети
+CLASSIFY_BATCH = int(os.getenv("VIDEO_CLASSIFY_BATCH", "32"))
+# Повторная детекция лица не реже чем раз в VIDEO_REDETECT_EVERY анализируемых кадров
+REDETECT_EVERY = int(os.getenv("VIDEO_REDETECT_EVERY", "10"))
+# Параметры, от которых зависит итог; при их смене видео обрабатывается заново
+RESULT_PARAMS = {'fps': ANALYSIS_FPS, 'step': FRAME_STEP, 'detect': DETECT_WIDTH,
+                 'min_face': MIN_FACE_SIZE, 'redetect': REDETECT_EVERY}
+
+# Конвейер: потоки классификации, ёмкость очереди пачек лиц и потоки вычислений
+# внутри каждой сети (torch и tensorflow)
+INFER_WORKERS = int(os.getenv("VIDEO_INFER_WORKERS", "2"))
+QUEUE_BATCHES = int(os.getenv("VIDEO_QUEUE_BATCHES", "4"))
+INFER_THREADS = int(os.getenv("VIDEO_INFER_THREADS", "2"))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+DETECTIONS = Counter('videoemo_face_detections_total', 'Запуски детектора лиц')
+TRACKED = Counter('videoemo_face_tracked_total', 'Кадры, на которых лицо найдено трекером без детекции')
+DETECTIONS_PER_VIDEO = Histogram('videoemo_face_detections_per_video', 'Запуски детектора лиц на одно видео',
+                                 buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+# Ограничиваем внутренние потоки сетей, чтобы рабочие потоки не конкурировали за ядра
+if INFER_THREADS > 0:
+    torch.set_num_threads(INFER_THREADS)
+    tf.config.threading.set_intra_op_parallelism_threads(INFER_THREADS)
+
 # Initialize FER model
-fer_model = FER(mtcnn=False)
+fer_model = FER(mtcnn=False, min_face_size=MIN_FACE_SIZE)
 
 # Load Valence MLP regressor
 # Load local Valence MLP regressor files
@@ -93,6 +135,70 @@ bi_model = BiLSTMClassifier(len(emotion_labels), 128, len(emotion_labels))
 bi_model.load_state_dict(torch.load(bilstm_path, map_location='cpu'))
 bi_model.eval()
 
+def frame_step(fps):
+    """Шаг между анализируемыми кадрами"""
+    if ANALYSIS_FPS > 0 and fps > 0:
+        return max(1, int(round(fps / ANALYSIS_FPS)))
+    return max(1, FRAME_STEP)
+
+
+# Столбцы покадровых вероятностей в порядке emotion_labels и перестановка
+# выходов классификатора FER в этот порядок
+FRAME_COLUMNS = [f"{emo}_video" for emo in emotion_labels]
+FER_ORDER = [FER_LABELS.index(k) for k in EMOTION_MAPPING]
+
+
+# Декодирование и поиск лиц в одном потоке, классификация - пулом потоков
+frame_pipeline = FramePipeline(lambda faces: classify_faces(fer_model, faces),
+                               workers=INFER_WORKERS, queue_size=QUEUE_BATCHES, batch_size=CLASSIFY_BATCH)
+
+
+def read_faces(cap, step, tracker):
+    """Выдаёт (номер кадра, вырезанное лицо) для анализируемых кадров видео"""
+    idx = 0
+    while True:
+        # Пропускаемые кадры только захватываются, без декодирования в изображение
+        if idx % step:
+            if not cap.grab(): break
+            idx += 1
+            continue
+        ret, frame = cap.read()
+        if not ret: break
+        box = tracker.update(frame)
+        if box is not None:
+            face = face_crop(frame, box)
+            if face is not None:
+                yield idx, face
+        idx += 1
+
+
+def read_archive_faces(frames, step, tracker):
+    """Выдаёт (номер кадра архива, вырезанное лицо) из архива кадров vid2snd"""
+    for idx in range(0, len(frames), step):
+        frame = frames[idx]
+        if frame.ndim == 2:
+            # Серый архив: трекер и FER ждут BGR
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        box = tracker.update(frame)
+        if box is not None:
+            face = face_crop(frame, box)
+            if face is not None:
+                yield idx, face
+
+
+def open_archive(frames_file):
+    """Архив кадров vid2snd: описание и кадры (n, h, w) серые или (n, h, w, 3) BGR через np.memmap"""
+    frames_path = os.path.join(DATA_DIR, frames_file)
+    with open(frames_path + '.json') as f:
+        meta = json.load(f)
+    shape = (meta['count'], meta['height'], meta['width'])
+    if meta.get('format', 'bgr24') != 'gray':
+        shape += (3,)
+    if not meta['count']:
+        return meta, np.empty(shape, dtype=np.uint8)
+    return meta, np.memmap(frames_path, dtype=np.uint8, mode='r', shape=shape)
+
+
 # Callback for processing video
 
 def callback(ch, method, properties, body):
@@ -102,100 +208,91 @@ def callback(ch, method, properties, body):
     video_file = msg['video_file']
     timestamp = msg['timestamp']
 
-    video_path = os.path.join(DATA_DIR, video_file)
-    if not os.path.exists(video_path):
-        logging.error(f"Video not found: {video_path}")
+    frames_file = msg.get('frames_file')
+    has_archive = frames_file and os.path.exists(os.path.join(DATA_DIR, frames_file + '.json'))
+    source_key = store.key_of(frames_file) if has_archive else msg.get('video_key')
+    result_key = source_key and store.derive(source_key, 'videoemo', RESULT_PARAMS)
+    cached = result_key and store.load_json(result_key)
+    if cached:
+        cached.update(user_id=user_id, timestamp=timestamp)
+        channel.basic_publish(exchange=EXCHANGE, routing_key='', body=json.dumps(cached))
+        logging.info(f"Video {video_file} already processed")
         return
 
-    # Frame-level FER predictions
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    logging.info(f'FPS - {fps}') 
-    fer_records = []
-    idx = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
-        det = fer_model.detect_emotions(frame)
-        if det:
-            em = det[0]['emotions']
-            mapped = {f"{EMOTION_MAPPING[k]}_video": v for k,v in em.items()}
-            dom = max(mapped, key=mapped.get)
-            fer_records.append({
-                'Frame_Number_video': idx,
-                'Video_Time_video': idx/fps,
-                **mapped,
-                'Dominant_Emotion_video': dom
-            })
-        idx += 1
-    cap.release()
-    df = pd.DataFrame(fer_records)
-    logging.info(f'FER отработал   - {len(fer_records)}')    
+    tracker = FaceTracker(fer_model, DETECT_WIDTH, redetect_every=REDETECT_EVERY)
+    if has_archive:
+        # Кадры уже декодированы и прорежены vid2snd: читаем архив без декодирования видео
+        meta, frames = open_archive(frames_file)
+        fps = meta['source_fps']
+        frames_fps = meta['fps']
+        logging.info(f'FPS - {fps}, архив кадров {frames_file} - {meta["count"]} кадров, {frames_fps} к/с')
+        step = frame_step(frames_fps)
+        classified = frame_pipeline.run(lambda: read_archive_faces(frames, step, tracker))
+        del frames
+    else:
+        video_path = os.path.join(DATA_DIR, video_file)
+        if not os.path.exists(video_path):
+            logging.error(f"Video not found: {video_path}")
+            return
+
+        # Frame-level FER predictions
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames_fps = fps
+        logging.info(f'FPS - {fps}') 
+        step = frame_step(fps)
+        try:
+            classified = frame_pipeline.run(lambda: read_faces(cap, step, tracker))
+        finally:
+            cap.release()
+    DETECTIONS.inc(tracker.detections)
+    TRACKED.inc(tracker.tracked)
+    DETECTIONS_PER_VIDEO.observe(tracker.detections)
+    analysed = tracker.detections + tracker.tracked
+    logging.info(f'Детекций лица - {tracker.detections}, трекер - {tracker.tracked} из {analysed} кадров')
+
+    # Покадровые вероятности (округление как в FER.detect_emotions)
+    # Номера кадров - в потоке, из которого они прочитаны (архив или исходное видео)
+    frame_store = FrameStore(FRAME_COLUMNS, frames_fps, window=10, capacity=max(len(classified), 1))
+    for idx, row in classified:
+        frame_store.append(idx, np.round(np.asarray(row)[FER_ORDER], 2))
+    logging.info(f'FER отработал   - {len(frame_store)}')
+    if not len(frame_store):
+        logging.error(f"No faces found in video {video_file}")
+        return
     # Compute summary metrics
     summary = {}
     summary['fps_video'] = fps
+    summary['analysis_fps_video'] = frames_fps / step
+    # MLP и BiLSTM читают тот же непрерывный буфер без копирования
+    X = torch.from_numpy(frame_store.probs)
     # Valence via MLP
-    feats = [f"{emo}_video" for emo in emotion_labels]
-    if all(c in df.columns for c in feats):
-        X = torch.tensor(df[feats].values, dtype=torch.float32)
-        with torch.no_grad():
-            v_pred = mlp(X).squeeze().numpy()
-        df['valence_mlp_video'] = v_pred
-        summary['valence_mean_video']   = float(np.mean(v_pred))
-        summary['valence_median_video'] = float(np.median(v_pred))
-        summary['valence_trimmed_mean_video'] = float(trim_mean(v_pred, 0.1))
-    # Emotion argmax
-    df['emotion_argmax_video'] = df[[f"{emo}_video" for emo in emotion_labels]].idxmax(axis=1)
-    # Mode, sum, smoothed, confident
-    summary['emotion_mode_video'] = df['emotion_argmax_video'].mode().iloc[0]
-    sums = df[[f"{emo}_video" for emo in emotion_labels]].sum()
-    summary['emotion_sum_video'] = sums.idxmax()
-    # Smoothed
-    modes = [Counter(df['emotion_argmax_video'][max(0,i-9):i+1]).most_common(1)[0][0] for i in range(len(df))]
-    summary['emotion_smoothed_video'] = Counter(modes).most_common(1)[0][0]
-    # Confident
-    confid = df[[f"{emo}_video" for emo in emotion_labels]].max(axis=1) >= 0.6
-    if confid.any(): summary['emotion_confident_video'] = df.loc[confid,'emotion_argmax_video'].mode().iloc[0]
-    # Mean/max per emotion
-    for emo in emotion_labels:
-        summary[f"{emo.lower()}_mean_video"] = float(df[f"{emo}_video"].mean())
-        summary[f"{emo.lower()}_max_video"]  = float(df[f"{emo}_video"].max())
+    with torch.no_grad():
+        v_pred = mlp(X).squeeze().numpy()
+    summary.update(valence_summary(v_pred))
+    # Mode, sum, smoothed, confident, mean/max per emotion
+    summary.update(frame_store.summary())
     # BiLSTM summary
-    seq = torch.tensor(df[[f"{emo}_video" for emo in emotion_labels]].values, dtype=torch.float32).unsqueeze(0)
     with torch.no_grad():
-        out = bi_model(seq)
+        out = bi_model(X.unsqueeze(0))
     preds = out.squeeze(0).argmax(dim=1).numpy()
     uniq = sorted(set(preds))
     summary['emotion_bilstm_video'] = ",".join([emotion_labels[i] for i in uniq])
 
     # Build message
     result = {**summary}
-    # add raw emotion probabilities at video level: mean from df
+    # add raw emotion probabilities at video level: mean over frames
     for emo in emotion_labels:
-        result[f"{emo.lower()}_video"] = float(df[f"{emo}_video"].mean())
+        result[f"{emo.lower()}_video"] = summary[f"{emo.lower()}_mean_video"]
     # dominant, valence_video, arousal_video placeholders (if needed)
     result['emotion_mode_video'] = summary['emotion_mode_video']
     result['valence_mean_video'] = summary['valence_mean_video']
-        # Позитивные и негативные эмоции
-        
-    pos = ["happy_mean_video"]
-    neg = ["angry_mean_video", "scared_mean_video", "disgusted_mean_video", "sad_mean_video"]
-    val =result['valence_mean_video']
-    if val > 0.1:
-        pos.append("surprised_mean_video")
-    elif val < -0.1:
-        neg.append("surprised_mean_video")
-
-    pos_vals = [ result[emo] for emo in pos]
-    neg_vals = [ result[emo] for emo in neg]
-
-    result["mean_positive_video"] = np.mean(pos_vals)
-    result["min_positive_video"] = np.min(pos_vals)
-    result["max_positive_video"] = np.max(pos_vals)
-    result["mean_negative_video"] = np.mean(neg_vals)
-    result["min_negative_video"] = np.min(neg_vals)
-    result["max_negative_video"] = np.max(neg_vals)
-
+    # Позитивные и негативные эмоции по средним вероятностям; удивление
+    # разделяется по валентности MLP
+    scores = to_matrix([{emo: result[f"{emo.lower()}_mean_video"] for emo in emotion_labels}])
+    result.update(emotion_fields(scores, "video", valence=[result['valence_mean_video']], classic=False)[0])
+    if result_key:
+        store.save_json(result_key, result)
 
     result['user_id'] = user_id
     result['timestamp'] = timestamp
@@ -205,8 +302,13 @@ def callback(ch, method, properties, body):
     logging.info(f"Processed video {video_file}")
 
 
+channel.exchange_declare(exchange=EXCHANGE_IN, exchange_type="fanout")
 channel.queue_declare(queue='extract_vid_emo', durable=True)
 channel.queue_bind(exchange=EXCHANGE_IN, queue='extract_vid_emo', routing_key='')
+# Очередь раньше была привязана к обменнику video - снимаем старую привязку,
+# иначе каждое видео обрабатывалось бы дважды
+channel.exchange_declare(exchange=EXCHANGE_VIDEO, exchange_type="fanout")
+channel.queue_unbind(queue='extract_vid_emo', exchange=EXCHANGE_VIDEO, routing_key='')
 channel.basic_consume(queue='extract_vid_emo', on_message_callback=callback, auto_ack=True)
 
 
@@ -217,4 +319,5 @@ channel.basic_consume(queue='extract_vid_emo', on_message_callback=callback, aut
 if __name__ == "__main__":
     # Запускаем режим ожидания прихода сообщений
     logging.info(f"Сервис извлечения эмоций из видео стартует...")
+    start_http_server(METRICS_PORT)
     channel.start_consuming()
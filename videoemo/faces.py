@@ -0,0 +1,161 @@
+import cv2
+import numpy as np
+
+
+# Порядок выходов классификатора FER
+FER_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+# Вход классификатора FER: серое лицо 64x64
+FACE_SIZE = (64, 64)
+# Расширение рамки лица и поля вокруг кадра - как в FER.detect_emotions
+FACE_OFFSETS = (10, 10)
+FRAME_PADDING = 40
+
+
+def downscale(frame, width=0):
+    """Уменьшает кадр до ширины width; возвращает кадр и коэффициент масштаба"""
+    height, frame_width = frame.shape[:2]
+    if not width or frame_width <= width:
+        return frame, 1.0
+    scale = frame_width / width
+    return cv2.resize(frame, (width, int(round(height / scale))), interpolation=cv2.INTER_AREA), scale
+
+
+def find_face(fer_model, small):
+    """Рамка первого лица детектора FER на (уменьшенном) кадре или None"""
+    faces = fer_model.find_faces(small, bgr=True)
+    if len(faces) == 0:
+        return None
+    return tuple(int(v) for v in faces[0])
+
+
+def to_full(box, scale):
+    return tuple(int(round(v * scale)) for v in box)
+
+
+def detect_face(fer_model, frame, detect_width=0):
+    """
+    Ищет лицо детектором FER на уменьшенной до detect_width копии кадра.
+    Возвращает рамку (x, y, w, h) первого лица в координатах исходного кадра
+    или None.
+    """
+    small, scale = downscale(frame, detect_width)
+    box = find_face(fer_model, small)
+    return None if box is None else to_full(box, scale)
+
+
+class FaceTracker:
+    """
+    Кэш положения лица между детекциями.
+
+    Лицо ищется детектором FER раз в redetect_every анализируемых кадров, а
+    между детекциями рамка сдвигается и масштабируется по оптическому потоку
+    Лукаса-Канаде для угловых точек внутри неё (на уменьшенном сером кадре).
+    Точки проверяются прямым и обратным потоком; если надёжных точек меньше
+    min_points или их доля ниже min_ratio, лицо сразу ищется заново.
+    """
+
+    LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+    def __init__(self, fer_model, detect_width=0, redetect_every=10, min_points=8, min_ratio=0.5, max_error=1.0):
+        self.fer_model = fer_model
+        self.detect_width = detect_width
+        self.redetect_every = redetect_every
+        self.min_points = min_points
+        self.min_ratio = min_ratio
+        self.max_error = max_error
+        self.detections = 0
+        self.tracked = 0
+        self.reset()
+
+    def reset(self):
+        self.box = None
+        self.gray = None
+        self.points = None
+        self.since_detection = 0
+
+    def _init_points(self, gray, box):
+        x, y, w, h = box
+        mask = np.zeros_like(gray)
+        mask[max(y, 0):y + h, max(x, 0):x + w] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=50, qualityLevel=0.01, minDistance=3, mask=mask)
+        return points if points is not None and len(points) >= self.min_points else None
+
+    def _detect(self, small, gray):
+        self.detections += 1
+        self.since_detection = 0
+        self.box = find_face(self.fer_model, small)
+        self.points = None if self.box is None else self._init_points(gray, self.box)
+        self.gray = gray
+        return self.box
+
+    def _track(self, gray):
+        """Сдвигает рамку по потоку; возвращает новую рамку или None при потере лица"""
+        if self.points is None:
+            return None
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None, **self.LK_PARAMS)
+        backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, forward, None, **self.LK_PARAMS)
+        error = np.linalg.norm((self.points - backward).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.max_error)
+        if good.sum() < self.min_points or good.mean() < self.min_ratio:
+            return None
+        old, new = self.points.reshape(-1, 2)[good], forward.reshape(-1, 2)[good]
+        # Масштаб - по отношению расстояний точек до их центра
+        old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1).mean()
+        new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1).mean()
+        zoom = new_spread / old_spread if old_spread > 0 else 1.0
+        shift = np.median(new - old, axis=0)
+        x, y, w, h = self.box
+        cx, cy = x + w / 2 + shift[0], y + h / 2 + shift[1]
+        w, h = w * zoom, h * zoom
+        self.points = new.reshape(-1, 1, 2)
+        return int(round(cx - w / 2)), int(round(cy - h / 2)), int(round(w)), int(round(h))
+
+    def update(self, frame):
+        """Рамка лица на очередном анализируемом кадре в координатах исходного кадра или None"""
+        small, scale = downscale(frame, self.detect_width)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        box = None
+        if self.box is not None and self.since_detection < self.redetect_every:
+            box = self._track(gray)
+        if box is None:
+            box = self._detect(small, gray)
+        else:
+            self.tracked += 1
+            self.since_detection += 1
+            self.box = box
+            self.gray = gray
+        return None if box is None else to_full(box, scale)
+
+
+def face_crop(frame, box):
+    """
+    Вырезает лицо из полноразмерного кадра так же, как FER.detect_emotions:
+    квадратная рамка со смещениями, серое 64x64, значения в [-1, 1].
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    # Поля заполняются средней яркостью двух нижних строк кадра
+    fill = cv2.mean(gray[-2:])[0]
+    gray = cv2.copyMakeBorder(gray, FRAME_PADDING, FRAME_PADDING, FRAME_PADDING, FRAME_PADDING,
+                              cv2.BORDER_CONSTANT, value=fill)
+    x, y, w, h = box
+    # Рамка к квадрату по большей стороне
+    if w < h:
+        x, w = x - (h - w) // 2, h
+    elif h < w:
+        y, h = y - (w - h) // 2, w
+    x_off, y_off = FACE_OFFSETS
+    x1, x2 = x - x_off + FRAME_PADDING, x + w + x_off + FRAME_PADDING
+    y1, y2 = y - y_off + FRAME_PADDING, y + h + y_off + FRAME_PADDING
+    x1, y1 = max(x1, 0), max(y1, 0)
+    face = gray[max(0, y1 - FRAME_PADDING):y2 + FRAME_PADDING, max(0, x1 - FRAME_PADDING):x2 + FRAME_PADDING]
+    if face.size == 0:
+        return None
+    face = cv2.resize(face, FACE_SIZE).astype(np.float32)
+    return (face / 255.0 - 0.5) * 2.0
+
+
+def classify_faces(fer_model, faces):
+    """Вероятности эмоций (n, 7) в порядке FER_LABELS для пачки вырезанных лиц"""
+    batch = np.expand_dims(np.stack(faces), -1)
+    return np.asarray(fer_model._classify_emotions(batch))
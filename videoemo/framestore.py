@@ -0,0 +1,118 @@
+from collections import deque
+
+import numpy as np
+from scipy.stats import trim_mean
+
+
+class FrameStore:
+    """
+    Покадровые вероятности эмоций одного видео в непрерывном массиве.
+
+    Строки (кадр, len(labels)) float32 лежат подряд в заранее выделенном
+    буфере, который удваивается при заполнении; probs - представление без
+    копирования, его можно сразу передавать в MLP и BiLSTM. При добавлении
+    кадра обновляется скользящая мода самой вероятной эмоции по последним
+    window кадрам: счётчики окна меняются на O(1), а при равенстве частот
+    выигрывает эмоция, раньше встретившаяся в окне (как у Counter.most_common).
+    """
+
+    def __init__(self, labels, fps, window=10, capacity=1024):
+        self.labels = list(labels)
+        self.fps = fps
+        self.window = window
+        self.size = 0
+        self._probs = np.empty((capacity, len(self.labels)), dtype=np.float32)
+        self._frames = np.empty(capacity, dtype=np.int64)
+        self._argmax = np.empty(capacity, dtype=np.int8)
+        self._smoothed = np.empty(capacity, dtype=np.int8)
+        # Позиции каждой эмоции в текущем окне по возрастанию
+        self._positions = [deque() for _ in self.labels]
+
+    def _grow(self):
+        capacity = len(self._probs) * 2
+        for name in ('_probs', '_frames', '_argmax', '_smoothed'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self, frame_number, probs):
+        if self.size == len(self._probs):
+            self._grow()
+        i = self.size
+        self._probs[i] = probs
+        self._frames[i] = frame_number
+        top = int(np.argmax(self._probs[i]))
+        self._argmax[i] = top
+
+        # Сдвиг окна: уходит кадр i - window, приходит кадр i
+        if i >= self.window:
+            self._positions[self._argmax[i - self.window]].popleft()
+        self._positions[top].append(i)
+        best, best_count, best_first = 0, 0, None
+        for label, positions in enumerate(self._positions):
+            count = len(positions)
+            if count > best_count or (count == best_count and count and positions[0] < best_first):
+                best, best_count, best_first = label, count, positions[0]
+        self._smoothed[i] = best
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def probs(self):
+        return self._probs[:self.size]
+
+    @property
+    def frames(self):
+        return self._frames[:self.size]
+
+    @property
+    def times(self):
+        """Время кадров в секундах по номеру исходного кадра"""
+        return self.frames / self.fps
+
+    @property
+    def argmax(self):
+        return self._argmax[:self.size]
+
+    @property
+    def smoothed(self):
+        return self._smoothed[:self.size]
+
+    def _mode(self, indices):
+        """Самая частая метка; при равенстве - первая по алфавиту (как pandas mode)"""
+        counts = np.bincount(indices, minlength=len(self.labels))
+        return min(label for label, count in zip(self.labels, counts) if count == counts.max())
+
+    def summary(self, confident=0.6):
+        """Сводные признаки видео, все вычисления - по столбцам массива"""
+        probs = self.probs
+        summary = {}
+        summary['emotion_mode_video'] = self._mode(self.argmax)
+        summary['emotion_sum_video'] = self.labels[int(np.argmax(probs.sum(axis=0, dtype=np.float64)))]
+        # Мода скользящих мод; при равенстве - мода, раньше встретившаяся в видео
+        values, first, counts = np.unique(self.smoothed, return_index=True, return_counts=True)
+        winners = counts == counts.max()
+        summary['emotion_smoothed_video'] = self.labels[values[winners][np.argmin(first[winners])]]
+        confid = probs.max(axis=1) >= confident
+        if confid.any():
+            summary['emotion_confident_video'] = self._mode(self.argmax[confid])
+        means = probs.mean(axis=0, dtype=np.float64)
+        maxes = probs.max(axis=0)
+        for label, mean, peak in zip(self.labels, means.tolist(), maxes.tolist()):
+            emo = label[:-len('_video')].lower()
+            summary[f"{emo}_mean_video"] = mean
+            summary[f"{emo}_max_video"] = peak
+        return summary
+
+
+def valence_summary(values):
+    """Среднее, медиана и усечённое среднее валентности по кадрам"""
+    values = np.atleast_1d(values)
+    return {
+        'valence_mean_video': float(np.mean(values)),
+        'valence_median_video': float(np.median(values)),
+        'valence_trimmed_mean_video': float(trim_mean(values, 0.1)),
+    }
@@ -0,0 +1,90 @@
+import queue
+import threading
+
+
+class FramePipeline:
+    """
+    Конвейер обработки видео: поток декодирования -> ограниченная очередь ->
+    пул потоков классификации.
+
+    Поток декодирования выполняет produce() - читает кадры, ищет/отслеживает
+    лицо и выдаёт (номер кадра, вырезанное лицо); лица собираются в пачки по
+    batch_size и кладутся в очередь из queue_size пачек. Когда очередь
+    заполнена, декодирование ждёт, поэтому в памяти одновременно не больше
+    queue_size + workers пачек лиц независимо от длины видео. Рабочие потоки
+    вызывают classify(лица) (сеть FER отпускает GIL на время вычислений), а
+    результаты собираются обратно в порядке кадров.
+    """
+
+    def __init__(self, classify, workers=2, queue_size=4, batch_size=32):
+        self.classify = classify
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = batch_size
+
+    def run(self, produce):
+        """Возвращает [(номер кадра, результат classify для лица), ...] по возрастанию номера кадра"""
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        results = {}
+        errors = []
+
+        def put(item):
+            # Ожидание места в очереди прерывается, если рабочий поток упал
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                batch, seq = [], 0
+                for item in produce():
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        if not put((seq, batch)):
+                            return
+                        batch, seq = [], seq + 1
+                if batch:
+                    put((seq, batch))
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                for _ in range(self.workers):
+                    put(None)
+
+        def work():
+            # После ошибки в любом потоке оставшиеся пачки не обрабатываются
+            while not stop.is_set():
+                try:
+                    item = batches.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    return
+                seq, batch = item
+                try:
+                    results[seq] = (batch, self.classify([face for _, face in batch]))
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+
+        threads = [threading.Thread(target=decode, name='videoemo-decode', daemon=True)]
+        threads += [threading.Thread(target=work, name=f'videoemo-infer-{i}', daemon=True)
+                    for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        ordered = []
+        for seq in sorted(results):
+            batch, outputs = results[seq]
+            ordered.extend((idx, output) for (idx, _), output in zip(batch, outputs))
+        return ordered
@@ -8,7 +8,8 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
-import psycopg2
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
+from pgpool import ConnectionPool
 import base64
 import ssl
 
@@ -22,13 +23,17 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "dbpassword")
 with open("/run/secrets/postgres_password", "r") as f:
     DB_PASSWORD = f.read().strip()
     
-conn = psycopg2.connect(
+# Пул соединений: каждый запрос берёт своё соединение и возвращает его
+db_pool = ConnectionPool(
+    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+    checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    health_check_interval=float(os.getenv("DB_POOL_HEALTH_CHECK", "30")),
     dbname=DB_NAME,
     user=DB_USER,
     password=DB_PASSWORD,
     host=DB_HOST
 )
-cur = conn.cursor()
 
 
 
@@ -93,26 +98,23 @@ class User:
         return check_password_hash(self.password_hash, password)
 
     def save(self):
-        try:
-            with conn.cursor() as cur:
-                if self.id is None:
-                    cur.execute(
-                        "INSERT INTO users (username, publicname, sex, password_hash) VALUES (%s,%s,%s,%s) RETURNING id",
-                        (self.username, self.publicname, self.sex, self.password_hash)
-                    )
-                    self.id = cur.fetchone()[0]
-                else:
-                    cur.execute(
-                        "UPDATE users SET username=%s, sex=%s, publicname=%s, password_hash=%s WHERE id=%s",
-                        (self.username, self.publicname, self.sex, self.password_hash, self.id)
-                    )
-        finally:
-            conn.commit()
+        with db_pool.connection() as conn, conn.cursor() as cur:
+            if self.id is None:
+                cur.execute(
+                    "INSERT INTO users (username, publicname, sex, password_hash) VALUES (%s,%s,%s,%s) RETURNING id",
+                    (self.username, self.publicname, self.sex, self.password_hash)
+                )
+                self.id = cur.fetchone()[0]
+            else:
+                cur.execute(
+                    "UPDATE users SET username=%s, sex=%s, publicname=%s, password_hash=%s WHERE id=%s",
+                    (self.username, self.publicname, self.sex, self.password_hash, self.id)
+                )
 
     @classmethod
     def get_by_username(cls, username):
         logging.info(f"User {username} requested auth")
-        with conn.cursor() as cur:
+        with db_pool.connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT id, username, publicname, sex, password_hash FROM users WHERE username= %s;", (str(username),))
             row = cur.fetchone()
             if row:
@@ -175,6 +177,17 @@ def index():
     """Возвращает HTML-страницу"""
     return render_template("index.html")
 
+
+@app.route("/metrics")
+def metrics():
+    """Метрики Prometheus (в т.ч. ожидание соединения в пуле БД)"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Несколько рабочих процессов gunicorn: собираем метрики всех
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
   
   
 
@@ -182,12 +195,13 @@ def index():
         
 
 if __name__ == "__main__":
-    # Запускаем RabbitMQ в фоновом потоке
+    # Режим разработки: встроенный сервер Flask.
+    # В контейнере приложение запускается через gunicorn (см. gunicorn.conf.py)
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     context.load_cert_chain('./certs/cert.pem', './certs/key.pem')
     logging.info("webserver start.")    
     app.run(host="0.0.0.0", 
             port=5001, 
-            debug=True,        
+            debug=os.getenv("FLASK_DEBUG") == "1",
             ssl_context= context#'adhoc'
             )
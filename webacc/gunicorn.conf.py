@@ -0,0 +1,22 @@
+import os
+
+from prometheus_client import multiprocess
+
+# Рабочий сервер для webacc: несколько процессов, в каждом пул потоков
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', '5001')}"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "8"))
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+certfile = os.getenv("WEB_CERTFILE", "./certs/cert.pem")
+keyfile = os.getenv("WEB_KEYFILE", "./certs/key.pem")
+
+accesslog = "-"
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
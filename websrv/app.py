@@ -1,16 +1,24 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, session, redirect, url_for, flash
+from flask import Flask, Response, request, jsonify, send_from_directory, render_template, session, redirect, url_for, flash
 import time
 import logging
-import pika
 import json
 import os
-import threading
+import queue
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
-import psycopg2
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
+from pgpool import ConnectionPool
+from publisher import Publisher
+from notifier import QuestionNotifier, format_sse
+from question_queue import QuestionQueue, QuestionRecord
+from events import EventListener, EXCHANGE_EVENTS
+from uploads import UploadSessions, UploadError
+from artifacts import ArtifactStore
 import base64
+import hmac
+import hashlib
 import ssl
 
 # Настройки подключения к PostgreSQL
@@ -23,13 +31,17 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "dbpassword")
 with open("/run/secrets/postgres_password", "r") as f:
     DB_PASSWORD = f.read().strip()
     
-conn = psycopg2.connect(
+# Пул соединений: каждый запрос берёт своё соединение и возвращает его
+db_pool = ConnectionPool(
+    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+    checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    health_check_interval=float(os.getenv("DB_POOL_HEALTH_CHECK", "30")),
     dbname=DB_NAME,
     user=DB_USER,
     password=DB_PASSWORD,
     host=DB_HOST
 )
-cur = conn.cursor()
 
 #очереди RabbitMQ
 EXCHANGE = 'video'
@@ -38,9 +50,19 @@ EXCHANGE_SELF_REPORT = 'self_report'
 
 EXCHANGE_IN = 'tts'
 
+# Параметры потока вопросов (Server-Sent Events)
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))  # комментарий-пинг, секунды
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))    # пауза перед переподключением клиента
+# Аудио вопроса не меняется после записи TTS, поэтому кэшируется клиентом надолго
+QUESTION_AUDIO_MAX_AGE = int(os.getenv("QUESTION_AUDIO_MAX_AGE", str(365 * 24 * 3600)))
+
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
+# БД очереди вопросов общая для рабочих процессов gunicorn и потребителя consumer.py
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("QUESTIONS_DB_URI", 'sqlite:///app.db')
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Ждём освобождения блокировки SQLite вместо немедленной ошибки
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 
@@ -57,19 +79,28 @@ logging.basicConfig(level=logging.INFO,
                     )
 
 # ### https://habr.com/ru/companies/otus/articles/761444/
-# # Создаём подключение по адресу rabbitmq:
-connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-channel = connection.channel()
+# # Общий для процесса публикатор: одно соединение под блокировкой, переиспользуется между запросами
+publisher = Publisher('rabbitmq')
 
-channel.exchange_declare(exchange=EXCHANGE, exchange_type="fanout")
-channel.exchange_declare(exchange=EXCHANGE_AUTH, exchange_type="fanout")
-channel.exchange_declare(exchange=EXCHANGE_SELF_REPORT, exchange_type="fanout")
+publisher.declare(EXCHANGE)
+publisher.declare(EXCHANGE_AUTH)
+publisher.declare(EXCHANGE_SELF_REPORT)
+publisher.declare(EXCHANGE_EVENTS)
 
 # Папка для хранения данных
 DATA_DIR = "./data"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Возобновляемые загрузки видео-ответов частями
+uploads = UploadSessions(DATA_DIR, max_chunk=int(os.getenv("UPLOAD_MAX_CHUNK", str(8 * 1024 * 1024))),
+                         ttl=float(os.getenv("UPLOAD_TTL_HOURS", "24")) * 3600)
+# Брошенные загрузки проверяются при начале новой, не чаще раза в интервал
+UPLOAD_EXPIRE_INTERVAL = float(os.getenv("UPLOAD_EXPIRE_INTERVAL", "600"))
+uploads_expired_at = 0.0
+# Загруженные ответы переносятся в хранилище под ключом содержимого
+store = ArtifactStore(DATA_DIR)
+
 # Декоратор для защиты маршрутов, требующих авторизации
 
 
@@ -108,26 +139,23 @@ class User:
         return check_password_hash(self.password_hash, password)
 
     def save(self):
-        try:
-            with conn.cursor() as cur:
-                if self.id is None:
-                    cur.execute(
-                        "INSERT INTO users (username, publicname, sex, password_hash) VALUES (%s,%s,%s,%s) RETURNING id",
-                        (self.username, self.publicname, self.sex, self.password_hash)
-                    )
-                    self.id = cur.fetchone()[0]
-                else:
-                    cur.execute(
-                        "UPDATE users SET username=%s, sex=%s, publicname=%s, password_hash=%s WHERE id=%s",
-                        (self.username, self.publicname, self.sex, self.password_hash, self.id)
-                    )
-        finally:
-            conn.commit()
+        with db_pool.connection() as conn, conn.cursor() as cur:
+            if self.id is None:
+                cur.execute(
+                    "INSERT INTO users (username, publicname, sex, password_hash) VALUES (%s,%s,%s,%s) RETURNING id",
+                    (self.username, self.publicname, self.sex, self.password_hash)
+                )
+                self.id = cur.fetchone()[0]
+            else:
+                cur.execute(
+                    "UPDATE users SET username=%s, sex=%s, publicname=%s, password_hash=%s WHERE id=%s",
+                    (self.username, self.publicname, self.sex, self.password_hash, self.id)
+                )
 
     @classmethod
     def get_by_username(cls, username):
         logging.info(f"User {username} requested auth")
-        with conn.cursor() as cur:
+        with db_pool.connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT id, username, publicname, sex, password_hash FROM users WHERE username= %s;", (str(username),))
             row = cur.fetchone()
             if row:
@@ -144,9 +172,89 @@ class Question(db.Model):
     exit_q = db.Column(db.Integer, nullable=False)
     dialog = db.Column(db.String(256), default='')
 
-# Создаем таблицы (если их еще нет)
+# Выборка очереди пользователя по порядку поступления
+question_order_index = db.Index('ix_question_user_created', Question.user_id, Question.created_at)
+
+
+# Очереди неподтверждённых вопросов в памяти (сквозная запись в БД)
+question_queue = QuestionQueue()
+
+# Создаем таблицы (если их еще нет) и восстанавливаем очереди из БД
 with app.app_context():
     db.create_all()
+    # create_all не добавляет индексы в уже существующую таблицу
+    question_order_index.create(bind=db.engine, checkfirst=True)
+    question_queue.load(Question.query.order_by(Question.created_at).all())
+
+
+def question_event(question):
+    """Описание вопроса для отправки клиенту через /question_stream"""
+    return {
+        'id': question.id,
+        'text': question.text,
+        'exit': question.exit_q,
+        'dialog': question.dialog,
+        'audio_url': question_audio_url(question.user_id, question.file_name),
+    }
+
+
+def audio_signature(user_id, fname):
+    """Подпись пары (пользователь, файл) секретным ключом приложения"""
+    message = f"{user_id}:{fname}".encode('utf-8')
+    return hmac.new(app.secret_key.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def question_audio_url(user_id, fname):
+    """
+    Постоянный адрес аудио вопроса для пользователя. Файлы TTS общие для
+    всех, кому задан тот же текст, поэтому доступ даёт подпись в адресе:
+    она выдаётся только вместе с вопросом и действует и после его
+    подтверждения (повторы и Range-запросы, кэш браузера).
+    """
+    return f"/question_audio/{audio_signature(user_id, fname)}/{fname}"
+
+
+def send_question_audio(fname, max_age):
+    """
+    Отдаёт аудио вопроса с ETag/Last-Modified и поддержкой Range.
+    Если TTS сохранил рядом сжатую копию .ogg (Opus) и клиент явно её
+    запросил (?format=ogg или Accept: audio/ogg), отдаётся она.
+    """
+    compressed = os.path.splitext(fname)[0] + '.ogg'
+    wants_ogg = request.args.get('format') == 'ogg' or \
+        any(mime == 'audio/ogg' and quality > 0 for mime, quality in request.accept_mimetypes)
+    if wants_ogg and os.path.exists(os.path.join(DATA_DIR, compressed)):
+        fname = compressed
+    response = send_from_directory(DATA_DIR, fname, conditional=True, etag=True, max_age=max_age)
+    # Вопросы персональные: кэшировать может только браузер пользователя
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.vary.add('Accept')
+    return response
+
+
+# Подписчики на новые вопросы (Server-Sent Events)
+notifier = QuestionNotifier()
+
+
+def handle_event(event):
+    """Применяет событие очереди вопросов к состоянию этого процесса"""
+    if event['type'] == 'question_added':
+        record = question_queue.push(QuestionRecord(**event['question']))
+        # Сразу отправляем вопрос подключённым клиентам пользователя
+        notifier.publish(record.user_id, question_event(record))
+    elif event['type'] == 'question_acked':
+        question_queue.remove(event['user_id'], event['id'])
+
+
+def reload_questions():
+    with app.app_context():
+        question_queue.load(Question.query.order_by(Question.created_at).all())
+
+
+def start_event_listener():
+    """Запускает приём событий очереди вопросов (по одному на рабочий процесс)"""
+    EventListener(handle_event, on_connect=reload_questions).start()
     
 
 # Маршрут для авторизации
@@ -176,15 +284,7 @@ def login():
                 'work': work,
                 'timestamp':tstamp
             }           
-            connection_pub = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-            channel_pub = connection_pub.channel()
-            channel_pub.exchange_declare(exchange=EXCHANGE_AUTH, exchange_type="fanout")
-            channel_pub.basic_publish(
-                exchange=EXCHANGE_AUTH,
-                routing_key='',
-                body=json.dumps(message)
-            )
-            connection_pub.close()              
+            publisher.publish(EXCHANGE_AUTH, json.dumps(message))
             return redirect(url_for("index"))
          else:
               flash("Неверное имя пользователя или пароль", "danger")
@@ -222,6 +322,17 @@ def index():
     """Возвращает HTML-страницу"""
     return render_template("index.html")
 
+
+@app.route("/metrics")
+def metrics():
+    """Метрики Prometheus (в т.ч. ожидание соединения в пуле БД)"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Несколько рабочих процессов gunicorn: собираем метрики всех
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
 @app.route("/get_question", methods=["GET"])
 def get_question():
     """
@@ -231,8 +342,8 @@ def get_question():
     """
     user_id = get_current_user_id()
     logging.info(f"User {user_id} requested a question")
-    # Ищем самый ранний вопрос для данного пользователя
-    question = Question.query.filter_by(user_id=user_id).order_by(Question.created_at).first()
+    # Самый ранний вопрос для данного пользователя
+    question = question_queue.peek(user_id)
     if not question:
         logging.info(f"No questions found for user {user_id}")
         return jsonify({"info": "No questions found for user"}), 404
@@ -247,11 +358,63 @@ def get_question():
         logging.error("Audio file for question not found")
         return jsonify({"error": "Audio file for question not found"}), 404
     b64_text = base64.b64encode(text.encode('utf-8')).decode('ascii')
-    # Отдаем аудио
-    response = send_from_directory(DATA_DIR, fname)
+    # Отдаем аудио; адрес не меняется между вопросами, поэтому клиент
+    # перепроверяет его по ETag и при повторе получает 304 без тела
+    response = send_question_audio(fname, max_age=0)
+    response.cache_control.no_cache = True
     # И заголовок с базой
     response.headers['X-Question-Text'] = b64_text
     response.headers['X-Exit'] = question.exit_q
+    response.headers['X-Question-Id'] = str(question.id)
+    # Неизменяемый адрес этого аудио для повторного воспроизведения из кэша
+    response.headers['X-Audio-URL'] = question_audio_url(user_id, fname)
+    return response
+
+
+@app.route("/question_stream", methods=["GET"])
+@login_required
+def question_stream():
+    """
+    Поток Server-Sent Events с вопросами для пользователя.
+    При подключении отдаёт все ещё не подтверждённые вопросы, затем
+    присылает новые сразу после их поступления от TTS.
+    Клиент подтверждает каждый вопрос через /ack_question с его id.
+    """
+    user_id = get_current_user_id()
+    logging.info(f"User {user_id} subscribed to questions")
+    events = notifier.subscribe(user_id)
+    pending = [question_event(q) for q in question_queue.pending(user_id)]
+
+    def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            for event in pending:
+                yield format_sse(event, event='question', event_id=event['id'])
+            while True:
+                try:
+                    event = events.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, event='question', event_id=event['id'])
+        finally:
+            notifier.unsubscribe(user_id, events)
+            logging.info(f"User {user_id} unsubscribed from questions")
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/question_audio/<signature>/<path:fname>", methods=["GET"])
+@login_required
+def question_audio(signature, fname):
+    """Аудиофайл вопроса по адресу, выданному текущему пользователю"""
+    user_id = get_current_user_id()
+    if not hmac.compare_digest(signature, audio_signature(user_id, fname)):
+        return jsonify({"error": "Question not found"}), 404
+    # Путь определяется текстом и голосом, содержимое после записи не меняется
+    response = send_question_audio(fname, max_age=QUESTION_AUDIO_MAX_AGE)
+    response.cache_control.immutable = True
     return response
 
 
@@ -261,15 +424,30 @@ def ack_question():
     """
     Подтверждает (удаляет) текущий вопрос для пользователя.
     Клиент вызывает этот эндпоинт после обработки вопроса.
+    Если передан id, подтверждается именно этот вопрос, иначе самый ранний.
     """
     user_id = get_current_user_id()
-    logging.info(f"User {user_id} acknowledged a question")
-    # Находим и удаляем самый ранний вопрос для пользователя
-    question = Question.query.filter_by(user_id=user_id).order_by(Question.created_at).first()
+    question_id = request.values.get("id", type=int)
+    logging.info(f"User {user_id} acknowledged a question {question_id}")
+    if question_id is not None:
+        question = question_queue.get(user_id, question_id)
+    else:
+        # Находим и удаляем самый ранний вопрос для пользователя
+        question = question_queue.peek(user_id)
     if question:
         fname = question.file_name
-        db.session.delete(question)
+        if question.dialog:
+            session['dialog'] = question.dialog
+        # Сквозная запись: сначала БД, затем очередь в памяти
+        Question.query.filter_by(id=question.id).delete()
         db.session.commit()
+        question_queue.remove(user_id, question.id)
+        # Остальные рабочие процессы удаляют вопрос у себя по событию
+        try:
+            publisher.publish(EXCHANGE_EVENTS, json.dumps(
+                {'type': 'question_acked', 'user_id': user_id, 'id': question.id}))
+        except Exception as e:
+            logging.error(f"Не удалось разослать подтверждение вопроса: {e}")
         logging.info(f"Question {fname} acknowledged and removed for user {user_id}")
         return jsonify({"message": "Question acknowledged"}), 200
     else:
@@ -285,7 +463,7 @@ def check_question():
     """
     user_id = get_current_user_id()
     logging.info(f"User {user_id} checking for questions")
-    question = Question.query.filter_by(user_id=user_id).order_by(Question.created_at).first()
+    question = question_queue.peek(user_id)
     if question:
         logging.info("Question found")
         return jsonify({"message": "Question found"}), 200
@@ -307,86 +485,127 @@ def upload_answer():
         video = request.files.get("video")
         if not video:
             return jsonify({"error": "Видео не найдено"}), 400
-        str_time = time.strftime("%a_%d_%b_%Y_%H_%M_%S", time.gmtime())
-        fname = f"{user_id}_{str_time}_full.mp4"
+        fname = new_answer_fname(user_id)
         video_path = os.path.join(DATA_DIR, fname)
         tstamp = time.mktime(time.gmtime())
         logging.info(f"webserver -  start write video - {video_path}.")    
 
         video.save(video_path)
-        logging.info(f"webserver -  end write video - {video_path}.")    
+        video_key, fname = store.put(video_path, '.mp4')
+        logging.info(f"webserver -  end write video - {fname}.")    
         logging.info(f"смена - {session['work']}.")    
 
-        message = {
-	        'user_id': user_id,
-    	    'video_file': fname,
-            'timestamp':tstamp,
-            'assistant': ass_text,
-            'workshift': session['work'],
-            'dialog': session['dialog'],
-            'sex' : session["sex"]
-	    }
-        # Открываем новое подключение и канал для публикации
-        connection_pub = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-        channel_pub = connection_pub.channel()
-        channel_pub.exchange_declare(exchange=EXCHANGE, exchange_type="fanout")
-        channel_pub.basic_publish(
-            exchange=EXCHANGE,
-            routing_key='',
-            body=json.dumps(message)
-        )
-        connection_pub.close()
+        publish_answer(user_id, fname, video_key, tstamp, ass_text)
 
         return jsonify({"message": "Видео успешно загружено"}), 200
     except Exception as e:
         logging.error(f"error in upload_answer: {e}")
         return jsonify({"error": "Ошибка при обработке запроса"}), 500
+
+
+def new_answer_fname(user_id):
+    str_time = time.strftime("%a_%d_%b_%Y_%H_%M_%S", time.gmtime())
+    return f"{user_id}_{str_time}_full.mp4"
+
+
+def publish_answer(user_id, fname, video_key, tstamp, ass_text):
+    """Сообщает сервисам анализа о новом видео-ответе (fname - путь в хранилище)"""
+    message = {
+        'user_id': user_id,
+        'video_file': fname,
+        'video_key': video_key,
+        'timestamp': tstamp,
+        'assistant': ass_text,
+        'workshift': session['work'],
+        'dialog': session['dialog'],
+        'sex': session["sex"]
+    }
+    publisher.publish(EXCHANGE, json.dumps(message))
+
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    body = {"error": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+
+@app.route("/upload/init", methods=["POST"])
+@login_required
+def upload_init():
+    """
+    Начинает возобновляемую загрузку видео-ответа.
+    Возвращает upload_id; далее части отправляются PUT /upload/<upload_id>?offset=N,
+    а загрузка завершается POST /upload/<upload_id>/finalize.
+    """
+    global uploads_expired_at
+    user_id = get_current_user_id()
+    if time.monotonic() - uploads_expired_at > UPLOAD_EXPIRE_INTERVAL:
+        uploads_expired_at = time.monotonic()
+        try:
+            uploads.expire()
+        except OSError as e:
+            logging.error(f"Не удалось удалить брошенные загрузки: {e}")
+    fname = new_answer_fname(user_id)
+    upload_id = uploads.create(user_id, fname,
+                               text=request.values.get('text'),
+                               timestamp=time.mktime(time.gmtime()))
+    logging.info(f"webserver - start upload {upload_id} - {fname}.")
+    return jsonify({"upload_id": upload_id, "offset": 0, "max_chunk": uploads.max_chunk}), 201
+
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+@login_required
+def upload_status(upload_id):
+    """Текущее смещение загрузки - с него клиент продолжает после обрыва"""
+    with uploads.locked(upload_id):
+        meta = uploads.get(upload_id, get_current_user_id())
+        offset = uploads.offset(meta)
+    return jsonify({"upload_id": upload_id, "offset": offset}), 200
+
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+@login_required
+def upload_chunk(upload_id):
+    """Принимает очередную часть видео и пишет её прямо в итоговый файл"""
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "Не указано смещение"}), 400
+    # Под блокировкой сессии: завершение не перенесёт файл посреди записи части
+    with uploads.locked(upload_id):
+        meta = uploads.get(upload_id, get_current_user_id())
+        new_offset = uploads.write(meta, offset, request.stream, request.content_length)
+    return jsonify({"upload_id": upload_id, "offset": new_offset}), 200
+
+
+@app.route("/upload/<upload_id>/finalize", methods=["POST"])
+@login_required
+def upload_finalize(upload_id):
+    """
+    Завершает загрузку и сразу передаёт видео на обработку.
+    Повтор после ошибки публикации не переносит файл заново, а публикует
+    уже сохранённый в хранилище. Одновременные завершения и запись частей
+    упорядочены блокировкой сессии: второе завершение получает 404.
+    """
+    user_id = get_current_user_id()
+    with uploads.locked(upload_id):
+        meta = uploads.get(upload_id, user_id)
+        size = uploads.offset(meta)
+        expected = request.values.get("size", type=int)
+        if expected is not None and expected != size:
+            return jsonify({"error": "Загружены не все части", "offset": size}), 409
+        if 'stored' not in meta:
+            video_key, fname = store.put(os.path.join(DATA_DIR, meta['fname']), '.mp4')
+            uploads.stored(upload_id, meta, size, video_key, fname)
+        video_key, fname = meta['key'], meta['stored']
+        publish_answer(user_id, fname, video_key, meta['timestamp'], meta['text'])
+        uploads.finish(upload_id)
+    logging.info(f"webserver - end upload {upload_id} - {fname} ({size} bytes).")
+    return jsonify({"message": "Видео успешно загружено", "video_key": video_key}), 200
   
   
   
-def consume_questions(): 
-    """Фоновый поток для ожидания сообщений из RabbitMQ"""
-    #Создаём функцию callback для обработки данных из очереди
-    def callback(ch, method, properties, body):
-        with app.app_context():
-            try:
-                logging.info(f'Получено сообщение - {body}')
-                message = json.loads(body)
-                user_id = message['user_id']
-                fname = message['fname']
-                text = message['text']
-                exit_q = message['exit']
-
-                if user_id is None or fname is None:
-                    logging.error("Invalid message received")
-                    return
-                # Создаем новую запись вопроса для пользователя
-                question = Question(user_id=user_id, file_name=fname, text=text,exit_q=exit_q)
-                if 'dialog' in message:
-                    logging.info(f"received dialog {message['dialog']} ")
-                    question.dialog = message['dialog']
-                db.session.add(question)
-                db.session.commit()
-                logging.info(f"Question for user {user_id} added to database")
-            except Exception as e:
-                logging.error(f"Error in callback: {e}")
-        
-    try:    
-        logging.info("Ожидание 30 секунд перед  попыткой подключения дадим всем запуститься...")
-        time.sleep(30)
-        connection1 = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-        channel1 = connection1.channel()
-        channel1.queue_declare(queue='websrv_text', durable=True)
-        channel1.queue_bind(exchange=EXCHANGE_IN, queue='websrv_text', routing_key='')
-        channel1.basic_consume(queue='websrv_text', on_message_callback=callback, auto_ack=True)
-        logging.info(f"стартуем получение вопросов пользователю")
-        channel1.start_consuming()
-    except Exception as e:
-        logging.error(f"Ошибка в consume_questions: {e}")
-    finally:
-        if connection1 and connection1.is_open:
-            connection1.close()
-           
 @app.route("/self_report", methods=["GET", "POST"])
 @login_required
 def self_report():
@@ -396,15 +615,7 @@ def self_report():
         form_data["timestamp"] = time.mktime(time.gmtime())
         logging.info(f"получен самоотчет: {form_data}")
         try:
-            connection_pub = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-            channel_pub = connection_pub.channel()
-            channel_pub.exchange_declare(exchange=EXCHANGE_SELF_REPORT, exchange_type="fanout")
-            channel_pub.basic_publish(
-                exchange=EXCHANGE_SELF_REPORT,
-                routing_key='',
-                body=json.dumps(form_data)
-            )
-            connection_pub.close()
+            publisher.publish(EXCHANGE_SELF_REPORT, json.dumps(form_data))
             logging.info("Ваш самоотчет отправлен успешно!")
             flash("Ваш самоотчет отправлен успешно!", "success")
         except Exception as e:
@@ -417,13 +628,15 @@ def self_report():
         
 
 if __name__ == "__main__":
-    # Запускаем RabbitMQ в фоновом потоке
-    threading.Thread(target=consume_questions, daemon=True).start()    
+    # Режим разработки: встроенный сервер Flask в одном процессе.
+    # В контейнере приложение запускается через gunicorn (см. gunicorn.conf.py),
+    # а вопросы от TTS принимает отдельный процесс consumer.py
+    start_event_listener()
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     context.load_cert_chain('./certs/cert.pem', './certs/key.pem')
     logging.info("webserver start.")    
     app.run(host="0.0.0.0", 
             port=5000, 
-            debug=True,        
+            debug=os.getenv("FLASK_DEBUG") == "1",
             ssl_context= context#'adhoc'
             )
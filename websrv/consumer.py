@@ -0,0 +1,95 @@
+import time
+import json
+import logging
+import os
+
+import pika
+
+from app import app, db, Question, publisher, EXCHANGE_IN
+from events import EXCHANGE_EVENTS
+from question_queue import to_record, record_payload
+
+
+# Пауза перед повторным подключением к RabbitMQ, секунды
+RECONNECT_DELAY = float(os.getenv("CONSUMER_RECONNECT_DELAY", "5"))
+
+
+def callback(ch, method, properties, body):
+    """
+    Сохраняет вопрос от TTS в БД и оповещает рабочие процессы веб-сервера.
+    Сообщение подтверждается только после записи и публикации события:
+    при сбое БД или RabbitMQ оно возвращается в очередь, некорректное -
+    отбрасывается.
+    """
+    logging.info(f'Получено сообщение - {body}')
+    try:
+        message = json.loads(body)
+        user_id = message['user_id']
+        fname = message['fname']
+        text = message['text']
+        exit_q = message['exit']
+    except (ValueError, KeyError, TypeError) as e:
+        logging.error(f"Invalid message received: {e!r}")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+    if user_id is None or fname is None:
+        logging.error("Invalid message received")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        return
+
+    with app.app_context():
+        try:
+            # Создаем новую запись вопроса для пользователя
+            question = Question(user_id=user_id, file_name=fname, text=text,exit_q=exit_q)
+            if 'dialog' in message:
+                logging.info(f"received dialog {message['dialog']} ")
+                question.dialog = message['dialog']
+            db.session.add(question)
+            db.session.commit()
+            logging.info(f"Question for user {user_id} added to database")
+        except Exception as e:
+            logging.error(f"Не удалось сохранить вопрос, вернём в очередь: {e}")
+            db.session.rollback()
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        try:
+            publisher.publish(EXCHANGE_EVENTS, json.dumps(
+                {'type': 'question_added', 'question': record_payload(to_record(question))}))
+        except Exception as e:
+            # Повторная доставка создаст вопрос заново: убираем эту запись
+            logging.error(f"Не удалось разослать вопрос, вернём в очередь: {e}")
+            try:
+                Question.query.filter_by(id=question.id).delete()
+                db.session.commit()
+            except Exception as e:
+                logging.error(f"Не удалось удалить неразосланный вопрос {question.id}: {e}")
+                db.session.rollback()
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def consume_questions():
+    """Получение вопросов из RabbitMQ с переподключением при сбоях"""
+    while True:
+        connection = None
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
+            channel = connection.channel()
+            channel.exchange_declare(exchange=EXCHANGE_IN, exchange_type="fanout")
+            channel.queue_declare(queue='websrv_text', durable=True)
+            channel.queue_bind(exchange=EXCHANGE_IN, queue='websrv_text', routing_key='')
+            channel.basic_qos(prefetch_count=10)
+            channel.basic_consume(queue='websrv_text', on_message_callback=callback, auto_ack=False)
+            logging.info(f"стартуем получение вопросов пользователю")
+            channel.start_consuming()
+        except Exception as e:
+            logging.error(f"Ошибка в consume_questions: {e}")
+        finally:
+            if connection and connection.is_open:
+                connection.close()
+        time.sleep(RECONNECT_DELAY)
+
+
+if __name__ == "__main__":
+    consume_questions()
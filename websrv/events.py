@@ -0,0 +1,56 @@
+import json
+import time
+import logging
+import threading
+
+import pika
+
+
+EXCHANGE_EVENTS = 'websrv_events'
+
+
+class EventListener:
+    """
+    Приём событий об очереди вопросов в каждом рабочем процессе веб-сервера.
+
+    Потребитель вопросов и обработчики /ack_question публикуют события в
+    fanout-обменник websrv_events; каждый процесс слушает его через
+    собственную эксклюзивную очередь и обновляет свою очередь вопросов в
+    памяти и подписчиков SSE. Соединение восстанавливается автоматически;
+    после каждой (пере)подписки вызывается on_connect, чтобы заново
+    синхронизировать состояние с БД и не потерять пропущенные события.
+    """
+
+    def __init__(self, handler, on_connect=None, host='rabbitmq', reconnect_delay=5.0):
+        self.handler = handler
+        self.on_connect = on_connect
+        self.parameters = pika.ConnectionParameters(host)
+        self.reconnect_delay = reconnect_delay
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='websrv-events', daemon=True)
+        self.thread.start()
+
+    def _callback(self, ch, method, properties, body):
+        try:
+            self.handler(json.loads(body))
+        except Exception as e:
+            logging.error(f"Ошибка обработки события {body}: {e}")
+
+    def run(self):
+        while True:
+            try:
+                connection = pika.BlockingConnection(self.parameters)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=EXCHANGE_EVENTS, exchange_type='fanout')
+                queue = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(exchange=EXCHANGE_EVENTS, queue=queue, routing_key='')
+                channel.basic_consume(queue=queue, on_message_callback=self._callback, auto_ack=True)
+                logging.info("Подписка на события очереди вопросов")
+                if self.on_connect is not None:
+                    self.on_connect()
+                channel.start_consuming()
+            except Exception as e:
+                logging.error(f"Потеряно соединение с событиями очереди вопросов: {e!r}")
+            time.sleep(self.reconnect_delay)
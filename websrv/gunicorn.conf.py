@@ -0,0 +1,29 @@
+import os
+
+from prometheus_client import multiprocess
+
+# Рабочий сервер для websrv: несколько процессов, в каждом пул потоков.
+# Потоки нужны и для долгих соединений /question_stream (SSE)
+bind = f"0.0.0.0:{os.getenv('FLASK_PORT', '5000')}"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "32"))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+certfile = os.getenv("WEB_CERTFILE", "./certs/cert.pem")
+keyfile = os.getenv("WEB_KEYFILE", "./certs/key.pem")
+
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # Каждый рабочий процесс получает события очереди вопросов
+    import app
+    app.start_event_listener()
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,56 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class QuestionNotifier:
+    """
+    Рассылка новых вопросов подключённым клиентам (Server-Sent Events).
+
+    Каждый открытый поток /question_stream подписывается на своего
+    пользователя и получает ограниченную очередь событий; слушатель событий
+    websrv_events публикует в неё вопрос сразу после сохранения. Переполненная
+    очередь (клиент не читает) не блокирует публикацию - событие теряется,
+    а вопрос клиент всё равно получит при переподключении.
+    """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        events = queue.Queue(maxsize=self.maxsize)
+        with self.lock:
+            self.subscribers[str(user_id)].add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self.lock:
+            subscribers = self.subscribers.get(str(user_id))
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self.subscribers[str(user_id)]
+
+    def publish(self, user_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(str(user_id), ()))
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass
+        return len(subscribers)
+
+
+def format_sse(data, event=None, event_id=None):
+    """Форматирует одно событие text/event-stream."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
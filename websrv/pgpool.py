@@ -0,0 +1,97 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from prometheus_client import Counter, Gauge, Histogram
+
+
+POOL_WAIT = Histogram('db_pool_wait_seconds', 'Ожидание свободного соединения в пуле',
+                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+POOL_IN_USE = Gauge('db_pool_connections_in_use', 'Выданные из пула соединения')
+POOL_TIMEOUTS = Counter('db_pool_checkout_timeouts_total', 'Запросы, не дождавшиеся соединения')
+POOL_RECONNECTS = Counter('db_pool_reconnects_total', 'Соединения, заменённые после сбоя или проверки')
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не появилось за отведённое время."""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений PostgreSQL для Flask-приложений.
+
+    Каждый запрос берёт соединение через connection() и возвращает его по
+    выходу из блока; при исчерпании пула поток ждёт не дольше
+    checkout_timeout. Соединение, простоявшее дольше health_check_interval,
+    перед выдачей проверяется SELECT 1, а сломанные соединения закрываются
+    и заменяются новыми.
+    """
+
+    def __init__(self, minconn, maxconn, checkout_timeout=10.0, health_check_interval=30.0, **dsn):
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **dsn)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.last_used = {}
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        conn = self.pool.getconn()
+        if not self._healthy(conn):
+            logging.warning("Соединение с БД неработоспособно, переподключаемся")
+            POOL_RECONNECTS.inc()
+            self.last_used.pop(id(conn), None)
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение на время блока; коммитит при успехе и откатывает при ошибке."""
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=self.checkout_timeout):
+            POOL_TIMEOUTS.inc()
+            raise PoolTimeout(f"Нет свободного соединения с БД за {self.checkout_timeout} с")
+        POOL_WAIT.observe(time.monotonic() - started)
+        broken = False
+        conn = None
+        try:
+            conn = self._checkout()
+            POOL_IN_USE.inc()
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                POOL_IN_USE.dec()
+                if broken or conn.closed:
+                    POOL_RECONNECTS.inc()
+                    self.last_used.pop(id(conn), None)
+                else:
+                    self.last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+            self.slots.release()
+
+    def close(self):
+        self.pool.closeall()
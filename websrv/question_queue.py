@@ -0,0 +1,82 @@
+import threading
+from collections import deque, namedtuple
+
+
+# Снимок вопроса, не привязанный к сессии SQLAlchemy
+QuestionRecord = namedtuple('QuestionRecord', ['id', 'user_id', 'file_name', 'text', 'exit_q', 'dialog', 'created_at'])
+
+
+def to_record(question):
+    return QuestionRecord(question.id, question.user_id, question.file_name, question.text,
+                          question.exit_q, question.dialog or '', question.created_at)
+
+
+def record_payload(record):
+    """Запись вопроса в виде словаря для передачи в событии"""
+    payload = record._asdict()
+    payload['created_at'] = str(record.created_at)
+    return payload
+
+
+class QuestionQueue:
+    """
+    Очереди неподтверждённых вопросов по пользователям в памяти процесса.
+
+    Источник истины для чтения: peek/check/ack не обращаются к SQLite.
+    Запись сквозная - вызывающий код сначала фиксирует изменение в БД, затем
+    отражает его здесь (push/remove), а при старте очередь восстанавливается
+    из таблицы вызовом load().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = {}
+
+    def load(self, questions):
+        """Перестраивает очереди по списку вопросов, упорядоченному по created_at."""
+        queues = {}
+        for question in questions:
+            queues.setdefault(str(question.user_id), deque()).append(to_record(question))
+        with self.lock:
+            self.queues = queues
+
+    def push(self, question):
+        record = to_record(question)
+        with self.lock:
+            pending = self.queues.setdefault(str(record.user_id), deque())
+            # Вопрос мог уже попасть в очередь при восстановлении из БД
+            if all(r.id != record.id for r in pending):
+                pending.append(record)
+        return record
+
+    def peek(self, user_id):
+        with self.lock:
+            pending = self.queues.get(str(user_id))
+            return pending[0] if pending else None
+
+    def get(self, user_id, question_id):
+        with self.lock:
+            for record in self.queues.get(str(user_id), ()):
+                if record.id == question_id:
+                    return record
+        return None
+
+    def pending(self, user_id):
+        with self.lock:
+            return list(self.queues.get(str(user_id), ()))
+
+    def remove(self, user_id, question_id):
+        with self.lock:
+            pending = self.queues.get(str(user_id))
+            if not pending:
+                return None
+            if pending[0].id == question_id:
+                record = pending.popleft()
+            else:
+                record = next((r for r in pending if r.id == question_id), None)
+                if record is None:
+                    return None
+                pending.remove(record)
+            if not pending:
+                del self.queues[str(user_id)]
+            return record
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import contextlib
+
+
+class UploadError(Exception):
+    """Ошибка сессии загрузки; status - HTTP-код ответа."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSessions:
+    """
+    Возобновляемые загрузки файлов частями.
+
+    Данные пишутся сразу в итоговый файл в data_dir, а описание сессии
+    хранится рядом в uploads/<id>.json, поэтому сессия переживает
+    перезапуск и доступна из любого рабочего процесса. Текущее смещение -
+    это размер файла на диске: после обрыва клиент запрашивает его и
+    продолжает с этого места.
+
+    Запись частей и завершение выполняются под блокировкой сессии
+    (flock на uploads/<id>.lock), общей для потоков и процессов. Сессии,
+    не обновлявшиеся дольше ttl секунд, удаляются вместе с недогруженным
+    файлом вызовом expire().
+    """
+
+    def __init__(self, data_dir, read_size=64 * 1024, max_chunk=8 * 1024 * 1024, ttl=24 * 3600):
+        self.data_dir = data_dir
+        self.sessions_dir = os.path.join(data_dir, "uploads")
+        self.read_size = read_size
+        self.max_chunk = max_chunk
+        self.ttl = ttl
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError("Некорректный идентификатор загрузки", 404)
+        return os.path.join(self.sessions_dir, f"{upload_id}.json")
+
+    def create(self, user_id, fname, **meta):
+        upload_id = uuid.uuid4().hex
+        meta.update({'user_id': user_id, 'fname': fname, 'created': time.time()})
+        # Пустой итоговый файл: части дописываются в него по смещению
+        open(os.path.join(self.data_dir, fname), 'wb').close()
+        self._save(upload_id, meta)
+        return upload_id
+
+    def _save(self, upload_id, meta):
+        path = self._meta_path(upload_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    @contextlib.contextmanager
+    def locked(self, upload_id, blocking=True):
+        """
+        Блокировка сессии на время блока. Состояние сессии читается заново
+        внутри блока: пока ждали, её могли завершить. Без blocking занятая
+        сессия даёт False вместо ожидания.
+        """
+        lock_path = self._meta_path(upload_id)[:-len('.json')] + '.lock'
+        with open(lock_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                # Сессия завершена или удалена: файл блокировки больше не нужен
+                if not os.path.exists(self._meta_path(upload_id)):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(lock_path)
+
+    def get(self, upload_id, user_id):
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Загрузка не найдена", 404)
+        if str(meta['user_id']) != str(user_id):
+            raise UploadError("Загрузка не найдена", 404)
+        return meta
+
+    def offset(self, meta):
+        if 'stored' in meta:
+            return meta['size']
+        return os.path.getsize(os.path.join(self.data_dir, meta['fname']))
+
+    def stored(self, upload_id, meta, size, key, rel):
+        """
+        Отмечает, что файл загрузки перенесён в хранилище под ключом key.
+        Сессия остаётся до finish(), поэтому повторное завершение после
+        сбоя публикации находит готовый файл вместо перенесённого.
+        """
+        meta.update(size=size, key=key, stored=rel)
+        self._save(upload_id, meta)
+
+    def write(self, meta, offset, stream, length):
+        """Дописывает часть длиной length из потока stream начиная с offset; возвращает новое смещение."""
+        if 'stored' in meta:
+            raise UploadError("Загрузка уже завершена", 409, offset=meta['size'])
+        if length is None:
+            raise UploadError("Не указан Content-Length", 411)
+        if length > self.max_chunk:
+            raise UploadError(f"Часть больше {self.max_chunk} байт", 413)
+        path = os.path.join(self.data_dir, meta['fname'])
+        with open(path, 'r+b') as f:
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError("Смещение не совпадает с загруженным объёмом", 409, offset=current)
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = stream.read(min(self.read_size, remaining))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+            f.flush()
+            if remaining:
+                # Обрыв посреди части: полученные байты сохраняются, клиент продолжит с нового смещения
+                raise UploadError("Часть получена не полностью", 400, offset=offset + length - remaining)
+            return offset + length
+
+    def finish(self, upload_id):
+        os.remove(self._meta_path(upload_id))
+
+    def expire(self, now=None):
+        """Удаляет брошенные сессии и их недогруженные файлы; возвращает число удалённых"""
+        now = time.time() if now is None else now
+        removed = 0
+        for name in os.listdir(self.sessions_dir):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            meta_path = os.path.join(self.sessions_dir, name)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                data_path = os.path.join(self.data_dir, meta['fname'])
+                # Последняя активность: запись части или изменение описания
+                used = max(os.path.getmtime(meta_path),
+                           os.path.getmtime(data_path) if os.path.exists(data_path) else 0)
+            except (OSError, ValueError, KeyError):
+                continue
+            if now - used < self.ttl:
+                continue
+            with self.locked(upload_id, blocking=False) as acquired:
+                # Занятую сессию (идёт запись или завершение) не трогаем
+                if not acquired or not os.path.exists(meta_path):
+                    continue
+                if 'stored' not in meta and os.path.exists(data_path):
+                    os.remove(data_path)
+                os.remove(meta_path)
+            removed += 1
+            logging.info(f"Удалена брошенная загрузка {upload_id} ({meta['fname']})")
+        return removed